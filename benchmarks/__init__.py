@@ -0,0 +1 @@
+# Benchmarks for the ETL stages, run from the repo root e.g. `python -m benchmarks.bench_diffs`
@@ -0,0 +1,64 @@
+# Daily-new / day-over-day columns: one groupby().shift() pass per column vs the sort-once kernel
+
+import sys
+import time
+
+import pandas as pd
+
+from covid_etl import kernels
+from benchmarks.synthetic import make_cases
+
+
+def groupby_diffs(cases):
+    # the way the ETLs used to do it, one groupby pass per shifted column
+    for metric in ['cases', 'deaths']:
+        cases[f'{metric}_shifted'] = (
+            cases.groupby(['county', 'state'])
+            [metric]
+            .shift(1)
+            .fillna(0)
+            .astype(int)
+        )
+        cases[f'{metric}_new'] = cases[metric] - cases[f'{metric}_shifted']
+
+    for metric in ['cases', 'deaths']:
+        cases[f'{metric}_new_shifted'] = (
+            cases.groupby(['county', 'state'])
+            [f'{metric}_new']
+            .shift(1)
+            .fillna(0)
+            .astype(int)
+        )
+        cases[f'{metric}_new_delta'] = ((cases[f'{metric}_new'] - cases[f'{metric}_new_shifted'])
+                                        / cases[f'{metric}_new_shifted'])
+    return cases
+
+
+def kernel_diffs(cases):
+    return kernels.add_diffs(cases, ['cases', 'deaths'], by = ['county', 'state'])
+
+
+def best_of(func, frame, repeat = 3):
+    times = []
+    for _ in range(repeat):
+        copy = frame.copy()
+        start = time.perf_counter()
+        result = func(copy)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    n_counties = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    cases = make_cases(n_counties, n_days)
+    print(f'{len(cases):,} rows ({n_counties} counties x {n_days} days)')
+
+    groupby_time, expected = best_of(groupby_diffs, cases)
+    kernel_time, result = best_of(kernel_diffs, cases)
+
+    pd.testing.assert_frame_equal(result, expected[result.columns], check_dtype = False)
+
+    print(f'groupby().shift(): {groupby_time:.3f}s')
+    print(f'kernel:            {kernel_time:.3f}s ({groupby_time / kernel_time:.1f}x)')
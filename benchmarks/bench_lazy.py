@@ -0,0 +1,46 @@
+# The case load ETL's stages: the pandas backend over the whole history vs the duckdb backend over the trailing days
+
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from covid_etl import nyt, refdata, stages
+from benchmarks.synthetic import make_cases, make_census_db, seed_refdata_cache
+
+SPECS = [('cases_new_sum12', 'cases_new', 12, 'sum'), ('cases_new_per1k_sum14', 'cases_new_per1k', 14, 'sum')]
+
+
+def run(census_db, snapshot_dir, cache_dir, backend):
+    # what the ETL runs, from a cold pipeline cache
+    pipe = stages.county_pipeline(census_db, SPECS, cache_dir = cache_dir, backend = backend)
+    pipe.add('nyt_snapshot', lambda: snapshot_dir, fingerprint = lambda: 'synthetic')
+    start = time.perf_counter()
+    recent, report = pipe.run('snapshot', 'quality_report')
+    return time.perf_counter() - start, recent, report, pipe
+
+
+if __name__ == '__main__':
+    n_counties = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    cases = make_cases(n_counties, n_days, special = True)
+    with tempfile.TemporaryDirectory() as tmp:
+        census_db = make_census_db(os.path.join(tmp, 'US_county_census.db'), cases)
+        snapshot_dir = os.path.join(tmp, 'nyt')
+        os.makedirs(snapshot_dir)
+        nyt._write_partitions(snapshot_dir, nyt._parse(cases.to_csv(index = False).encode()))
+        refdata.CACHE_DIR = seed_refdata_cache(os.path.join(tmp, 'cache'), cases)
+
+        pandas_time, expected, expected_report, _ = run(census_db, snapshot_dir, os.path.join(tmp, 'pandas'), 'pandas')
+        duckdb_time, result, report, pipe = run(census_db, snapshot_dir, os.path.join(tmp, 'duckdb'), 'duckdb')
+        scanned = len(pipe.get('quality'))
+
+    pd.testing.assert_frame_equal(result, expected, check_dtype = False, check_categorical = False, rtol = 1e-5)
+    assert report['date'] == expected_report['date']
+
+    print(f'{len(cases):,} rows ({n_counties} counties x {n_days} days), {len(result):,} counties in the snapshot')
+    print(f'pandas, whole history:    {pandas_time:.3f}s ({len(cases):,} rows)')
+    print(f'duckdb, trailing days:    {duckdb_time:.3f}s ({scanned:,} rows, {pandas_time / duckdb_time:.0f}x)')
@@ -0,0 +1,108 @@
+# Memory report: the county frames with the loaded dtypes (string keys, int64 counts, float64 rates) vs the
+# compact schema in covid_etl/schema.py, plus the time of the stages that group and merge on the county keys
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import fips, kernels, schema, stages
+from benchmarks.bench_rolling import SPECS
+from benchmarks.synthetic import make_cases
+
+
+def make_census(cases):
+    """Crosswalk and population frames for the synthetic counties, every county joining to itself."""
+    counties = cases[['fips', 'county', 'state']].drop_duplicates('fips').astype({'county': object, 'state': object})
+    crosswalk = pd.DataFrame({'fips': counties['fips'].to_numpy(dtype = np.int32),
+                              'pop_fips': counties['fips'].to_numpy(dtype = np.int32),
+                              'STNAME': counties['state'].to_numpy(),
+                              'COUNTY_KEY': counties['county'].str.lower().to_numpy()})
+    population = (crosswalk
+                  .assign(TOT_POP = lambda x: 10000 + x['fips'].astype(np.int64) * 37,
+                          region = lambda x: 'Region ' + (x['fips'] % 9).astype(str))
+                  .set_index('pop_fips')
+                  [['STNAME', 'COUNTY_KEY', 'TOT_POP', 'region']]
+                  .astype({'STNAME': object, 'COUNTY_KEY': object, 'region': object}))
+    return crosswalk, population
+
+
+def legacy_cases(cases):
+    # what read_csv / the Parquet snapshot handed the ETLs before: Python strings, int64 and float64 counts
+    return cases.astype({'county': object, 'state': object, 'cases': np.int64, 'deaths': np.float64})
+
+
+def legacy_percap(cases, crosswalk, population):
+    # the per-capita stage as it was, float64 rates and the label concatenated on every row
+    cases = kernels.add_daily_new(cases.copy(), ['cases', 'deaths'], by = ['county', 'state'])
+    cases = fips.assign_pop_fips(cases, crosswalk)
+    cases_percap = (fips.join_population(cases[stages.PERCAP_COLUMNS], population)
+                    .fillna({'deaths': 0, 'deaths_new': 0})
+                    .dropna()
+                    .assign(cases_per1k = lambda x: x.cases / x.TOT_POP * 1000,
+                            cases_new_per1k = lambda x: x.cases_new / x.TOT_POP * 1000,
+                            deaths_per1k = lambda x: x.deaths / x.TOT_POP * 1000,
+                            deaths_new_per1k = lambda x: x.deaths_new / x.TOT_POP * 1000,
+                            county_label = lambda x: x.county + ', ' + x.STNAME)
+                    .sort_values(['county_label', 'date']))
+    return kernels.add_day_over_day(cases_percap, ['cases_new', 'deaths_new'], by = ['county', 'state'])
+
+
+def compact_percap(cases, crosswalk, population):
+    census_tables = {'crosswalk': crosswalk, 'population': schema.compact_population(population)}
+    return stages.percap(stages.daily_new(cases), census_tables)
+
+
+def legacy_snapshot(cases_percap):
+    # the same groupbys and merges, keyed on the label strings
+    return stages.snapshot(stages.week_over_week(cases_percap.astype({'county_label': object})), 3, 100000)
+
+
+def compact_snapshot(cases_percap):
+    return stages.snapshot(stages.week_over_week(cases_percap), 3, 100000)
+
+
+def megabytes(df):
+    return df.memory_usage(deep = True).sum() / 2 ** 20
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    n_counties = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    cases = make_cases(n_counties, n_days)
+    crosswalk, population = make_census(cases)
+    print(f'{len(cases):,} rows ({n_counties} counties x {n_days} days)')
+
+    before = {'cases': legacy_cases(cases)}
+    after = {'cases': schema.compact_cases(cases)}
+
+    before_times, after_times = {}, {}
+    before_times['percap'], before['percap'] = timed(legacy_percap, before['cases'], crosswalk, population)
+    after_times['percap'], after['percap'] = timed(compact_percap, after['cases'], crosswalk, population)
+
+    before_times['rolling'], before['rolling'] = timed(stages.rolling, before['percap'], SPECS)
+    after_times['rolling'], after['rolling'] = timed(stages.rolling, after['percap'], SPECS)
+
+    before_times['snapshot'], before['snapshot'] = timed(legacy_snapshot, before['rolling'])
+    after_times['snapshot'], after['snapshot'] = timed(compact_snapshot, after['rolling'])
+
+    pd.testing.assert_series_equal(before['snapshot']['wkly_diff'], after['snapshot']['wkly_diff'],
+                                   check_dtype = False, check_exact = False, rtol = 1e-6)
+
+    print(f'{"frame":<12}{"before MB":>12}{"after MB":>12}{"ratio":>8}')
+    for name in ['cases', 'percap', 'rolling']:
+        print(f'{name:<12}{megabytes(before[name]):>12.1f}{megabytes(after[name]):>12.1f}'
+              f'{megabytes(before[name]) / megabytes(after[name]):>7.1f}x')
+
+    print(f'\n{"stage":<12}{"before s":>12}{"after s":>12}{"speedup":>8}')
+    for name in ['percap', 'rolling', 'snapshot']:
+        print(f'{name:<12}{before_times[name]:>12.3f}{after_times[name]:>12.3f}'
+              f'{before_times[name] / after_times[name]:>7.1f}x')
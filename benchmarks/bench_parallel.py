@@ -0,0 +1,39 @@
+# Per-county kernels on the whole frame vs on per-state partitions in a process pool (covid_etl/parallel.py)
+
+import os
+import sys
+
+import pandas as pd
+
+from covid_etl import schema, stages
+from benchmarks.bench_diffs import best_of
+from benchmarks.bench_memory import compact_percap, make_census
+from benchmarks.bench_rolling import SPECS
+from benchmarks.synthetic import make_cases
+
+
+def serial(cases, cases_percap):
+    return stages.daily_new(cases), stages.rolling(cases_percap, SPECS)
+
+
+def partitioned(cases, cases_percap, workers):
+    return stages.daily_new(cases, workers = workers), stages.rolling(cases_percap, SPECS, workers = workers)
+
+
+if __name__ == '__main__':
+    n_counties = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+
+    cases = schema.compact_cases(make_cases(n_counties, n_days))
+    cases_percap = compact_percap(cases, *make_census(cases))
+    print(f'{len(cases):,} rows ({n_counties} counties x {n_days} days), {workers} workers on {os.cpu_count()} cores')
+
+    serial_time, expected = best_of(lambda frame: serial(cases, frame), cases_percap)
+    parallel_time, result = best_of(lambda frame: partitioned(cases, frame, workers), cases_percap)
+
+    for got, want in zip(result, expected):
+        pd.testing.assert_frame_equal(got, want)
+
+    print(f'whole frame: {serial_time:.3f}s')
+    print(f'partitioned: {parallel_time:.3f}s ({serial_time / parallel_time:.1f}x)')
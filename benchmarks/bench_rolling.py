@@ -0,0 +1,60 @@
+# Rolling windows: one groupby().transform(lambda x: x.rolling(n)...) per column vs the cumulative-sum kernel
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import kernels
+from benchmarks.bench_diffs import best_of
+from benchmarks.synthetic import make_cases
+
+# the rolling columns capacity_vs_case_delta_etl.py builds
+SPECS = [('cases_new_MA', 'cases_new', 5, 'mean'),
+         ('cases_new_per1k_MA', 'cases_new_per1k', 5, 'mean'),
+         ('deaths_new_MA', 'deaths_new', 5, 'mean'),
+         ('deaths_new_per1k_MA', 'deaths_new_per1k', 5, 'mean'),
+         ('cases_new_per1k_sum7', 'cases_new_per1k', 7, 'sum'),
+         ('cases_new_sum12', 'cases_new', 12, 'sum'),
+         ('cases_new_delta_MA7', 'cases_new_delta', 7, 'mean'),
+         ('cases_new_delta_MA14', 'cases_new_delta', 14, 'mean')]
+
+
+def make_percap(n_counties, n_days):
+    cases = kernels.add_diffs(make_cases(n_counties, n_days), ['cases', 'deaths'])
+    population = 10000 + cases['fips'].to_numpy(dtype = np.int64) * 37
+    return (cases
+            .assign(cases_new_per1k = lambda x: x.cases_new / population * 1000,
+                    deaths_new_per1k = lambda x: x.deaths_new / population * 1000,
+                    county_label = lambda x: x.county + ', ' + x.state)
+            .sort_values(['county_label', 'date'])
+            .reset_index(drop = True))
+
+
+def transform_rolling(cases_percap):
+    for output, column, window, how in SPECS:
+        cases_percap[output] = (cases_percap
+                                .groupby('county_label')[column]
+                                .transform(lambda x: getattr(x.rolling(window), how)()))
+    return cases_percap
+
+
+def kernel_rolling(cases_percap):
+    return kernels.add_rolling(cases_percap, SPECS, by = 'county_label')
+
+
+if __name__ == '__main__':
+    n_counties = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    cases_percap = make_percap(n_counties, n_days)
+    print(f'{len(cases_percap):,} rows ({n_counties} counties x {n_days} days), {len(SPECS)} rolling columns')
+
+    transform_time, expected = best_of(transform_rolling, cases_percap)
+    kernel_time, result = best_of(kernel_rolling, cases_percap)
+
+    outputs = [output for output, *_ in SPECS]
+    pd.testing.assert_frame_equal(result[outputs], expected[outputs], check_exact = False, rtol = 1e-9, atol = 1e-9)
+
+    print(f'groupby().transform(rolling): {transform_time:.3f}s')
+    print(f'kernel:                       {kernel_time:.3f}s ({transform_time / kernel_time:.1f}x)')
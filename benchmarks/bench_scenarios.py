@@ -0,0 +1,53 @@
+# Capacity what-ifs: the rolling and capacity stages rerun once per scenario vs one broadcast over all of them
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import refdata, scenarios, schema, stages
+from benchmarks.bench_memory import compact_percap, make_census
+from benchmarks.synthetic import make_cases, seed_refdata_cache
+
+
+def per_scenario(cases_percap, county_beds, hospitalization_rate, available_beds, los_days):
+    # what sweeping the assumptions took before: the script rerun with each set of params
+    results = {}
+    for rate, available, los in zip(hospitalization_rate, available_beds, los_days):
+        los_column = f'cases_new_sum{los}'
+        recent = stages.snapshot(stages.rolling(cases_percap, [(los_column, 'cases_new', los, 'sum')]), 3, 100000)
+        capacity = stages.capacity(recent, county_beds, rate, available, los_column)
+        results[rate, available, los] = capacity.set_index('county_label')['free_bed_perc']
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    n_counties = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    cases = make_cases(n_counties, n_days)
+    cases_percap = compact_percap(schema.compact_cases(cases), *make_census(cases))
+    with tempfile.TemporaryDirectory() as tmp:
+        refdata.CACHE_DIR = seed_refdata_cache(os.path.join(tmp, 'cache'), cases)
+        county_beds = stages.county_beds()
+
+    # 4 hospitalization rates x 4 available-bed fractions x 5 lengths of stay
+    grid = scenarios.grid([0.1, 0.15, 0.2, 0.25], [0.3, 0.39, 0.5, 0.6], [7, 10, 12, 14, 21])
+    print(f'{len(cases_percap):,} rows ({n_counties} counties x {n_days} days), {len(grid[0])} scenarios')
+
+    start = time.perf_counter()
+    expected = per_scenario(cases_percap, county_beds, *grid)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = scenarios.capacity_scenarios(cases_percap, county_beds, *grid)
+    broadcast_time = time.perf_counter() - start
+
+    np.testing.assert_allclose(result.to_numpy(), expected.loc[result.index].to_numpy(),
+                               rtol = 1e-6, atol = 1e-6)
+
+    print(f'rerun per scenario: {loop_time:.3f}s')
+    print(f'broadcast:          {broadcast_time:.3f}s ({loop_time / broadcast_time:.0f}x)')
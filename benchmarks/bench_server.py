@@ -0,0 +1,55 @@
+# Load test for the chart data server: keep-alive clients hammering a mix of endpoints
+#
+#   python -m covid_etl.server --port 8000 &
+#   python -m benchmarks.bench_server http://127.0.0.1:8000 50 2000
+
+import asyncio
+import sys
+import time
+import urllib.parse
+
+PATHS = ['/snapshot?min_pop=100000',
+         '/snapshot?chart=capacity_vs_case_delta',
+         '/snapshot?chart=case_load_vs_case_delta',
+         '/charts/case_load_vs_case_delta']
+
+
+async def client(host, port, paths, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    for path in paths:
+        start = time.perf_counter()
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: gzip\r\n\r\n'.encode())
+        await writer.drain()
+
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def main(url, clients, requests):
+    url = urllib.parse.urlsplit(url)
+    latencies = []
+    per_client = [[PATHS[(i + j) % len(PATHS)] for j in range(requests // clients)] for i in range(clients)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(url.hostname, url.port, paths, latencies) for paths in per_client])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f'{len(latencies)} requests from {clients} clients in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s)')
+    print(f'latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:8000'
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    asyncio.run(main(url, clients, requests))
@@ -0,0 +1,71 @@
+# Week-over-week change: two date filters, two groupby-sums and a merge per date vs one kernel pass for every date
+
+import datetime
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import kernels, schema
+from benchmarks.bench_memory import compact_percap, make_census
+from benchmarks.synthetic import make_cases
+
+OUTPUTS = ['last_wk_cases', 'two_wks_ago_cases', 'wkly_diff']
+
+
+def merge_wkly_diff(cases_percap, snapshot_date):
+    # the way the snapshot stage used to do it, for one date
+    last_wk_max = snapshot_date
+    last_wk_min = last_wk_max - datetime.timedelta(days = 7)
+    two_wks_min = last_wk_max - datetime.timedelta(days = 14)
+
+    last_wk_total_cases = (cases_percap
+                           .query('date >= @last_wk_min and date < @last_wk_max')
+                           .groupby('county_label', observed = True)
+                           .aggregate({'cases_new': 'sum'})
+                           .rename(columns = {'cases_new': 'last_wk_cases'}))
+
+    two_wks_total_cases = (cases_percap
+                           .query('date >= @two_wks_min and date < @last_wk_min')
+                           .groupby('county_label', observed = True)
+                           .aggregate({'cases_new': 'sum'})
+                           .rename(columns = {'cases_new': 'two_wks_ago_cases'}))
+
+    wkly_diff = (last_wk_total_cases
+                 .merge(two_wks_total_cases, how = 'inner', on = 'county_label')
+                 .assign(wkly_diff = lambda x: (x['last_wk_cases'] - x['two_wks_ago_cases']) / x['two_wks_ago_cases']))
+
+    return (cases_percap
+            .query('date == @snapshot_date')
+            [['county_label', 'date']]
+            .merge(wkly_diff, how = 'left', on = 'county_label'))
+
+
+def merge_all_dates(cases_percap, dates):
+    return pd.concat([merge_wkly_diff(cases_percap, date) for date in dates], ignore_index = True)
+
+
+if __name__ == '__main__':
+    n_counties = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n_days = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    cases = schema.compact_cases(make_cases(n_counties, n_days))
+    cases_percap = compact_percap(cases, *make_census(cases))
+    dates = np.sort(cases_percap['date'].unique())
+    print(f'{len(cases_percap):,} rows ({n_counties} counties x {n_days} days)')
+
+    start = time.perf_counter()
+    expected = merge_all_dates(cases_percap, dates)
+    merge_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = kernels.add_week_over_week(cases_percap.copy())
+    kernel_time = time.perf_counter() - start
+
+    result = (expected[['county_label', 'date']]
+              .merge(result[['county_label', 'date'] + OUTPUTS], how = 'left', on = ['county_label', 'date']))
+    pd.testing.assert_frame_equal(result[OUTPUTS], expected[OUTPUTS], check_dtype = False, rtol = 1e-6)
+
+    print(f'filter + merge per date, {len(dates)} dates: {merge_time:.3f}s ({merge_time / len(dates):.3f}s per date)')
+    print(f'kernel, all dates:                 {kernel_time:.3f}s ({merge_time / kernel_time:.0f}x)')
@@ -0,0 +1,129 @@
+# Every county pipeline stage timed on synthetic data at a few scales, results saved as JSON to compare runs
+#
+#   python -m benchmarks.suite                                   # all scales, to benchmarks/results/
+#   python -m benchmarks.suite --scales small medium --compare benchmarks/results/<earlier run>.json
+#
+# The data comes from benchmarks/synthetic.py: NYT-shaped cases (with New York City and independent
+# cities), a census database and a hospitals GeoJSON, all in a temp directory, so nothing touches the
+# network or the real caches.  Stages run in pipeline order on the previous stages' outputs, each one
+# best of `--repeat`, plus `parse` (the NYT CSV into the compact schema) ahead of the snapshot load.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import nyt, refdata, schema, stages
+from benchmarks import synthetic
+from benchmarks.bench_rolling import SPECS
+
+# (counties, days) - 'large' is about the size of the real file a year in
+SCALES = {'small': (300, 120), 'medium': (1500, 250), 'large': (3200, 365)}
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def describe(value):
+    if isinstance(value, dict) and 'population' in value:
+        value = value['population']
+    if not hasattr(value, 'memory_usage'):
+        # the quality report or the snapshot location, no frame to speak of
+        return 0, 0.0
+    return len(value), float(value.memory_usage(deep = True).sum()) / 2 ** 20
+
+
+def run_scale(scale, n_counties, n_days, repeat):
+    cases = synthetic.make_cases(n_counties, n_days, special = True)
+    csv = cases.to_csv(index = False).encode()
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        census_db = synthetic.make_census_db(os.path.join(tmp, 'US_county_census.db'), cases)
+        snapshot_dir = os.path.join(tmp, 'nyt')
+        os.makedirs(snapshot_dir)
+        nyt._write_partitions(snapshot_dir, nyt._parse(csv))
+        refdata.CACHE_DIR = synthetic.seed_refdata_cache(os.path.join(tmp, 'cache'), cases)
+
+        pipe = stages.county_pipeline(census_db, SPECS, cache_dir = os.path.join(tmp, 'pipeline'))
+        pipe.add('nyt_snapshot', lambda: snapshot_dir, fingerprint = lambda: 'synthetic')
+
+        seconds, value = best_of(lambda: schema.compact_cases(nyt._parse(csv)), repeat)
+        results.append(('parse', seconds, value))
+
+        outputs = {}
+        for name, stage in pipe.stages.items():
+            inputs = [outputs[input_name] for input_name in stage.inputs]
+            seconds, outputs[name] = best_of(lambda: stage.func(*inputs, **stage.params), repeat)
+            results.append((name, seconds, outputs[name]))
+
+    return [{'scale': scale, 'counties': n_counties, 'days': n_days, 'rows': len(cases), 'stage': name,
+             'seconds': round(seconds, 5), 'rows_out': describe(value)[0], 'frame_mb': round(describe(value)[1], 2)}
+            for name, seconds, value in results]
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__)), check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    before = {(row['scale'], row['stage']): row['seconds'] for row in baseline['results']}
+    print(f'\ncompared with {baseline["commit"]} ({baseline["created"]})')
+    print(f'{"scale":<8}{"stage":<16}{"before s":>10}{"after s":>10}{"change":>9}')
+    for row in results:
+        key = (row['scale'], row['stage'])
+        if key in before:
+            print(f'{row["scale"]:<8}{row["stage"]:<16}{before[key]:>10.4f}{row["seconds"]:>10.4f}'
+                  f'{row["seconds"] / before[key] - 1:>+9.0%}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Time each county pipeline stage on synthetic data.')
+    parser.add_argument('--scales', nargs = '+', choices = list(SCALES), default = list(SCALES))
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--output', default = None, help = 'results file (default benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', default = None, help = 'an earlier results file to compare with')
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        n_counties, n_days = SCALES[scale]
+        rows = run_scale(scale, n_counties, n_days, args.repeat)
+        print(f'{scale}: {rows[0]["rows"]:,} rows ({n_counties} counties x {n_days} days)')
+        for row in rows:
+            print(f'  {row["stage"]:<16}{row["seconds"]:>9.4f}s {row["rows_out"]:>10,} rows {row["frame_mb"]:>8.1f} MB')
+        results += rows
+
+    created = datetime.datetime.now()
+    run = {'created': created.isoformat(timespec = 'seconds'), 'commit': commit(), 'python': platform.python_version(),
+           'pandas': pd.__version__, 'numpy': np.__version__, 'platform': platform.platform(),
+           'cpus': os.cpu_count(), 'repeat': args.repeat, 'results': results}
+
+    output = args.output or os.path.join(RESULTS_DIR, created.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+    with open(output, 'w') as f:
+        json.dump(run, f, indent = 2)
+    print(f'Results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,174 @@
+# Deterministic synthetic data shaped like the NYT us-counties file, so the benchmarks run without the network,
+# plus a matching census database and hospitals GeoJSON for running the whole county pipeline on it
+
+import datetime
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import census, fips, hospitals, refdata
+
+with open(os.path.join(refdata.BUNDLED_DIR, 'state_abbreviations.json')) as f:
+    STATE_ABBREVIATIONS = {name: abbrev for abbrev, name in json.load(f).items()}
+
+STATES = sorted(STATE_ABBREVIATIONS)
+
+REGIONS = ['Northeast', 'Midwest', 'South', 'West']
+
+# the census counties NYT reports as one "New York City", with their real FIPS codes
+NYC_BOROUGHS = {'New York': 36061, 'Kings': 36047, 'Queens': 36081, 'Bronx': 36005, 'Richmond': 36085}
+
+# every CITY_EVERY'th county is an independent city next to a county of the same name, like Baltimore
+CITY_EVERY = 50
+
+
+def _counties(n_counties, n_days, rng, special):
+    counties = pd.DataFrame({'county': [f'County {i}' for i in range(n_counties)],
+                             'state': [STATES[i % len(STATES)] for i in range(n_counties)],
+                             'fips': pd.array(np.arange(n_counties) + 1001, dtype = 'Int32'),
+                             # counties show up in the file on the day of their first case
+                             'first_day': rng.randint(0, n_days // 2, n_counties)})
+
+    if special:
+        cities = np.arange(1, n_counties - 1, CITY_EVERY)
+        counties.loc[cities, 'county'] = counties['county'].to_numpy()[cities + 1] + ' city'
+        counties.loc[cities, 'state'] = counties['state'].to_numpy()[cities + 1]
+        counties.loc[0, ['county', 'state', 'fips']] = ['New York City', 'New York', pd.NA]
+        counties.loc[0, 'first_day'] = 0
+
+    return counties
+
+
+def make_cases(n_counties = 3000, n_days = 300, seed = 0, special = False):
+    """Cumulative cases/deaths per county per day, in NYT file order (by date, then state and county).
+
+    With `special`, the first county is New York City (no FIPS, like the NYT file) and some counties
+    are "X city" independent cities in the same state as county "X", which covid_etl/fips.py joins to "X".
+    """
+    rng = np.random.RandomState(seed)
+    counties = _counties(n_counties, n_days, rng, special)
+
+    dates = pd.date_range('2020-01-21', periods = n_days)
+    county_idx = np.repeat(np.arange(n_counties), n_days)
+    day_idx = np.tile(np.arange(n_days), n_counties)
+
+    # daily new counts, mostly growing with the occasional negative revision like the real file
+    daily_cases = rng.poisson(np.linspace(1, 50, n_days)[day_idx] * rng.gamma(2, 1, n_counties)[county_idx])
+    daily_cases[rng.rand(len(daily_cases)) < 0.002] *= -1
+    daily_deaths = rng.binomial(daily_cases.clip(0), 0.02)
+
+    cases = pd.DataFrame({'county_idx': county_idx,
+                          'day_idx': day_idx,
+                          'cases': daily_cases.reshape(n_counties, n_days).cumsum(axis = 1).ravel().clip(0),
+                          'deaths': daily_deaths.reshape(n_counties, n_days).cumsum(axis = 1).ravel()})
+    cases = cases[cases['day_idx'] >= counties['first_day'].to_numpy()[cases['county_idx']]]
+
+    cases = cases.assign(date = dates[cases['day_idx']],
+                         county = counties['county'].to_numpy()[cases['county_idx']],
+                         state = counties['state'].to_numpy()[cases['county_idx']],
+                         fips = counties['fips'].array.take(cases['county_idx'].to_numpy()))
+
+    return (cases
+            .sort_values(['day_idx', 'state', 'county'], kind = 'mergesort')
+            [['date', 'county', 'state', 'fips', 'cases', 'deaths']]
+            .reset_index(drop = True))
+
+
+def make_census_table(cases, seed = 0):
+    """Census rows the way publish/census_etl.py leaves them, for the counties in `cases`.
+
+    Counties get a lowercase COUNTY_KEY, independent cities none (their CTYNAME has no "County"), and
+    New York City is its five boroughs keyed 'new york city'.  Two years, three age groups.
+    """
+    rng = np.random.RandomState(seed)
+
+    counties = cases[['county', 'state', 'fips']].drop_duplicates(['county', 'state'])
+    counties = counties[counties['fips'].notna()]
+    city = counties['county'].str.endswith(' city').to_numpy()
+    code = counties['fips'].to_numpy(dtype = np.int64)
+
+    boroughs = pd.DataFrame({'STATE': [code // 1000 for code in NYC_BOROUGHS.values()],
+                             'COUNTY': [code % 1000 for code in NYC_BOROUGHS.values()],
+                             'STNAME': 'New York',
+                             'CTYNAME': [name + ' County' for name in NYC_BOROUGHS],
+                             'COUNTY_KEY': 'new york city',
+                             'TOT_POP': rng.randint(400000, 2600000, len(NYC_BOROUGHS))})
+
+    # a long tail of small counties and a few big ones, cities smaller again
+    tot_pop = rng.lognormal(10.5, 1.3, len(counties)) * np.where(city, 0.3, 1) + 1000
+    counties = pd.DataFrame({'STATE': code // 1000,
+                             'COUNTY': code % 1000,
+                             'STNAME': counties['state'].to_numpy(),
+                             'CTYNAME': np.where(city, counties['county'], counties['county'] + ' County'),
+                             'COUNTY_KEY': np.where(city, None, counties['county'].str.lower()),
+                             'TOT_POP': tot_pop.astype(np.int64)})
+    counties = pd.concat([counties, boroughs], ignore_index = True)
+
+    rows = []
+    for year in (9, 10):
+        for agegrp, share in ((0, 1.0), (1, 0.06), (2, 0.065)):
+            tot_pop = (counties['TOT_POP'] * share * (0.99 if year == 9 else 1)).astype(np.int64)
+            rows.append(counties.assign(SUMLEV = 50, YEAR = year, AGEGRP = agegrp, TOT_POP = tot_pop,
+                                        TOT_MALE = tot_pop // 2, TOT_FEMALE = tot_pop - tot_pop // 2))
+
+    pop = pd.concat(rows, ignore_index = True)
+    pop['region'] = pop['STNAME'].map({state: REGIONS[i % len(REGIONS)] for i, state in enumerate(STATES)})
+    return pop[['SUMLEV', 'STATE', 'COUNTY', 'STNAME', 'CTYNAME', 'YEAR', 'AGEGRP', 'TOT_POP', 'TOT_MALE',
+                'TOT_FEMALE', 'COUNTY_KEY', 'region']]
+
+
+def make_census_db(path, cases, seed = 0):
+    """Census database for `cases` at `path`, written the way publish/census_etl.py writes the real one."""
+    pop = make_census_table(cases, seed)
+    conn = sqlite3.connect(path)
+    try:
+        pop.to_sql(name = 'census', con = conn, if_exists = 'replace')
+        crosswalk = fips.build_crosswalk(pop)
+        crosswalk.to_sql(name = 'fips_crosswalk', con = conn, if_exists = 'replace', index = False)
+        census.write_county_population(conn, pop, crosswalk, source = 'synthetic')
+    finally:
+        conn.close()
+    return path
+
+
+def make_hospitals(cases, seed = 0):
+    """ArcGIS-shaped hospital features for the counties in `cases`, a few facilities each."""
+    rng = np.random.RandomState(seed)
+
+    counties = cases[['county', 'state']].drop_duplicates()
+    counties = counties[~counties['county'].str.endswith(' city') & counties['county'].ne('New York City')]
+    names = list(zip(counties['county'], counties['state'])) + [(name, 'New York') for name in NYC_BOROUGHS]
+
+    types = list(hospitals.BED_TYPES) + ['PSYCHIATRIC', 'LONG TERM CARE']
+    features = []
+    for county, state in names:
+        for _ in range(rng.randint(0, 5)):
+            beds = int(rng.randint(10, 600)) if rng.rand() > 0.05 else hospitals.MISSING_BEDS
+            features.append({'type': 'Feature',
+                             'properties': {'ID': len(features), 'NAME': f'{county} Hospital {len(features)}',
+                                            'STATE': STATE_ABBREVIATIONS[state], 'COUNTY': county.upper(),
+                                            'TYPE': types[rng.randint(len(types))], 'BEDS': beds},
+                             'geometry': {'type': 'Point',
+                                          'coordinates': [round(rng.uniform(-125, -67), 6),
+                                                          round(rng.uniform(25, 49), 6)]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def seed_refdata_cache(cache_dir, cases, seed = 0):
+    """Fresh hospitals GeoJSON and state abbreviations in a covid_etl/refdata.py cache, so nothing is fetched."""
+    os.makedirs(cache_dir, exist_ok = True)
+    with open(os.path.join(refdata.BUNDLED_DIR, 'state_abbreviations.json')) as f:
+        abbreviations = f.read()
+
+    checked = datetime.datetime.now().isoformat(timespec = 'seconds')
+    for name, url, content in [('hospitals.geojson', refdata.HOSPITALS_URL, json.dumps(make_hospitals(cases, seed))),
+                               ('state_abbreviations.json', refdata.STATE_ABBREV_URL, abbreviations)]:
+        path = os.path.join(cache_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        with open(path + '.meta.json', 'w') as f:
+            json.dump({'url': url, 'etag': None, 'last_modified': None, 'checked': checked}, f)
+    return cache_dir
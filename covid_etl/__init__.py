@@ -0,0 +1 @@
+# Shared building blocks for the county ETL scripts and the publish job
@@ -0,0 +1,205 @@
+# Readers and writers for the county census database built by publish/census_etl.py
+#
+# Besides the full `census` table, the database holds a compact `county_population` table that's
+# already rolled up to the counties the case data joins to (see covid_etl/fips.py), one row per
+# county, year and age group with integer columns and a primary key on the lookup, plus a
+# `census_metadata` table saying what was loaded and when.
+
+import datetime
+import sqlite3
+
+import pandas as pd
+
+from covid_etl import fips, names
+
+SCHEMA_VERSION = 1
+
+# population columns carried into county_population, summed over the counties in each rollup
+POPULATION_COLUMNS = ['TOT_POP', 'TOT_MALE', 'TOT_FEMALE']
+
+# the columns of the county estimates file the ETLs use, out of the 80 or so with every sex and race.
+# STATE and COUNTY are int32 so STATE * 1000 + COUNTY, the FIPS code, doesn't overflow
+CENSUS_DTYPES = {'SUMLEV': 'int16', 'STATE': 'int32', 'COUNTY': 'int32', 'STNAME': str, 'CTYNAME': str,
+                 'YEAR': 'int8', 'AGEGRP': 'int8', 'TOT_POP': 'int32', 'TOT_MALE': 'int32', 'TOT_FEMALE': 'int32'}
+
+CHUNK_ROWS = 100000
+
+# data dictionary: https://www2.census.gov/programs-surveys/popest/technical-documentation/file-layouts/2010-2017/cc-est2017-alldata.pdf?#
+AGEGRP_DESCR = {0: 'Total', 1: '0-4', 2: '5-9', 3: '10-14', 4: '15-19', 5: '20-24', 6: '25-29', 7: '30-34', 8: '35-38',
+                9: '40-44', 10: '45-49', 11: '50-54', 12: '55-59', 13: '60-64', 14: '65-69', 15: '70-74',
+                16: '75-79', 17: '80-84', 18: '85+'}
+
+# the county characteristics files by vintage, and what their YEAR codes mean.  Each vintage numbers its
+# years from its own base, the ETLs take the population from the latest (highest) one by default
+POPEST_URL = 'https://www2.census.gov/programs-surveys/popest/datasets'
+VINTAGES = {
+    2017: {'url': f'{POPEST_URL}/2010-2017/counties/asrh/cc-est2017-alldata.csv',
+           'years': {1: '4/1/2010 census', 2: '4/1/2010 est. base', 3: '7/1/2010 est.', 4: '7/1/2011 est.',
+                     5: '7/1/2012 est.', 6: '7/1/2013 est.', 7: '7/1/2014 est.', 8: '7/1/2015 est.',
+                     9: '7/1/2016 est.', 10: '7/1/17 est.'}},
+    2019: {'url': f'{POPEST_URL}/2010-2019/counties/asrh/cc-est2019-alldata.csv',
+           'years': {1: '4/1/2010 census', 2: '4/1/2010 est. base', 3: '7/1/2010 est.', 4: '7/1/2011 est.',
+                     5: '7/1/2012 est.', 6: '7/1/2013 est.', 7: '7/1/2014 est.', 8: '7/1/2015 est.',
+                     9: '7/1/2016 est.', 10: '7/1/2017 est.', 11: '7/1/2018 est.', 12: '7/1/2019 est.'}},
+    2023: {'url': f'{POPEST_URL}/2020-2023/counties/asrh/cc-est2023-alldata.csv',
+           'years': {1: '4/1/2020 est. base', 2: '7/1/2020 est.', 3: '7/1/2021 est.', 4: '7/1/2022 est.',
+                     5: '7/1/2023 est.'}},
+}
+
+DEFAULT_VINTAGE = 2017
+
+
+def load_crosswalk(conn):
+    """FIPS crosswalk from the census DB, built on the fly for databases written before it was added."""
+    try:
+        return pd.read_sql('SELECT fips, pop_fips, STNAME, COUNTY_KEY FROM fips_crosswalk;', con = conn)
+    except pd.io.sql.DatabaseError:
+        counties = pd.read_sql('SELECT DISTINCT STATE, COUNTY, STNAME, CTYNAME, COUNTY_KEY FROM census;', con = conn)
+        return fips.build_crosswalk(counties)
+
+
+def _create_county_population(conn):
+    conn.execute('DROP TABLE IF EXISTS county_population;')
+    conn.execute('CREATE TABLE county_population ('
+                 'pop_fips INTEGER NOT NULL, YEAR INTEGER NOT NULL, AGEGRP INTEGER NOT NULL, '
+                 'STNAME TEXT NOT NULL, COUNTY_KEY TEXT NOT NULL, region TEXT, '
+                 + ', '.join(f'{column} INTEGER NOT NULL' for column in POPULATION_COLUMNS) +
+                 ', PRIMARY KEY (pop_fips, YEAR, AGEGRP)) WITHOUT ROWID;')
+
+
+def _write_metadata(conn, source, years, rows, vintage):
+    # the ETLs always ask for one year and age group across all counties
+    conn.execute('CREATE INDEX county_population_year_agegrp ON county_population (YEAR, AGEGRP);')
+
+    conn.execute('DROP TABLE IF EXISTS census_metadata;')
+    conn.execute('CREATE TABLE census_metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);')
+    conn.executemany('INSERT INTO census_metadata VALUES (?, ?);',
+                     [('schema_version', str(SCHEMA_VERSION)),
+                      ('source', source),
+                      ('vintage', str(vintage)),
+                      ('created', datetime.datetime.now().isoformat(timespec = 'seconds')),
+                      ('years', ','.join(str(year) for year in sorted(years))),
+                      ('county_population_rows', str(rows))])
+
+
+def write_county_population(conn, pop, crosswalk, source, vintage = DEFAULT_VINTAGE):
+    """Materialize `county_population` and `census_metadata` from the full census frame."""
+    # only counties with a join key count toward the population, same as joining on COUNTY_KEY did
+    county_population = (pop[pop['COUNTY_KEY'].notna()]
+                         .assign(fips = lambda x: x['STATE'] * 1000 + x['COUNTY'])
+                         .merge(crosswalk[['fips', 'pop_fips']], on = 'fips')
+                         .groupby(['pop_fips', 'YEAR', 'AGEGRP'])
+                         .aggregate({'STNAME': 'first', 'COUNTY_KEY': 'first', 'region': 'first',
+                                     **{column: 'sum' for column in POPULATION_COLUMNS}})
+                         .reset_index())
+
+    columns = ['pop_fips', 'YEAR', 'AGEGRP', 'STNAME', 'COUNTY_KEY', 'region'] + POPULATION_COLUMNS
+    rows = county_population[columns].astype(object).where(county_population[columns].notna(), None)
+
+    with conn:
+        _create_county_population(conn)
+        conn.executemany(f'INSERT INTO county_population VALUES ({", ".join("?" * len(columns))});',
+                         rows.itertuples(index = False, name = None))
+        _write_metadata(conn, source, pop['YEAR'].unique(), len(county_population), vintage)
+
+    return county_population
+
+
+def ingest(conn, source, vintage = DEFAULT_VINTAGE, regions = None, chunksize = CHUNK_ROWS):
+    """Stream a cc-est<vintage>-alldata file into the `census`, `fips_crosswalk` and `county_population` tables.
+
+    Only the CENSUS_DTYPES columns are read, `chunksize` rows at a time, and each chunk is keyed (see
+    covid_etl/names.py) and inserted before the next is read, so memory doesn't grow with the file.
+    `regions` maps state names to the census division stored with each row.  Returns the row count.
+    """
+    years = VINTAGES[vintage]['years']
+    lookup = names.load_lookup(conn)
+    columns = list(CENSUS_DTYPES) + ['COUNTY_KEY', 'YEAR_DESCR', 'AGEGRP_DESCR', 'region']
+
+    with conn:
+        conn.execute('DROP TABLE IF EXISTS census;')
+        conn.execute('CREATE TABLE census (' + ', '.join(
+            f'{column} {"TEXT" if CENSUS_DTYPES.get(column, str) is str else "INTEGER"}' for column in columns) + ');')
+
+    counties = []
+    total = 0
+    for chunk in pd.read_csv(source, usecols = list(CENSUS_DTYPES), dtype = CENSUS_DTYPES, encoding = 'ISO-8859-1',
+                             chunksize = chunksize):
+        county_key, lookup = names.county_keys(chunk['STNAME'], chunk['CTYNAME'], lookup)
+        chunk = chunk.assign(COUNTY_KEY = county_key,
+                             YEAR_DESCR = chunk['YEAR'].map(years),
+                             AGEGRP_DESCR = chunk['AGEGRP'].map(AGEGRP_DESCR),
+                             region = chunk['STNAME'].map(regions or {}))[columns]
+
+        with conn:
+            conn.executemany(f'INSERT INTO census VALUES ({", ".join("?" * len(columns))});',
+                             chunk.astype(object).where(chunk.notna(), None).itertuples(index = False, name = None))
+
+        # one row per county per year and age group, the crosswalk only needs each county once
+        counties.append(chunk[['STATE', 'COUNTY', 'STNAME', 'CTYNAME', 'COUNTY_KEY']]
+                        .drop_duplicates(['STATE', 'COUNTY']))
+        total += len(chunk)
+
+    # FIPS crosswalk from NYT county codes to the census counties above, so the ETLs join on integers
+    crosswalk = fips.build_crosswalk(pd.concat(counties, ignore_index = True))
+    crosswalk.to_sql(name = 'fips_crosswalk', con = conn, if_exists = 'replace', index = False)
+
+    # the rollup is done by SQLite straight from the census table, rather than from a frame of all of it
+    with conn:
+        _create_county_population(conn)
+        conn.execute('INSERT INTO county_population '
+                     'SELECT x.pop_fips, c.YEAR, c.AGEGRP, MIN(c.STNAME), MIN(c.COUNTY_KEY), MIN(c.region), '
+                     + ', '.join(f'SUM(c.{column})' for column in POPULATION_COLUMNS) +
+                     ' FROM census c JOIN fips_crosswalk x ON c.STATE * 1000 + c.COUNTY = x.fips '
+                     'WHERE c.COUNTY_KEY IS NOT NULL GROUP BY x.pop_fips, c.YEAR, c.AGEGRP;')
+        rows = conn.execute('SELECT COUNT(*) FROM county_population;').fetchone()[0]
+        file_years = [year for year, in conn.execute('SELECT DISTINCT YEAR FROM census;')]
+        _write_metadata(conn, source, file_years, rows, vintage)
+
+    names.write_lookup(conn, lookup)
+    return total
+
+
+def load_metadata(conn):
+    try:
+        return dict(conn.execute('SELECT key, value FROM census_metadata;').fetchall())
+    except sqlite3.OperationalError:
+        # written before the metadata table existed
+        return {}
+
+
+def load_population(conn, crosswalk = None, columns = (), year = None, agegrp = 0):
+    """Population per census join county (`pop_fips`) with STNAME, COUNTY_KEY and any extra `columns`.
+
+    Defaults to the latest estimate in the database (YEAR = 10, 2017, for the cc-est2017 file) and total
+    population (AGEGRP = 0).  Reads the pre-aggregated county_population table when the database has
+    one, otherwise rolls up the full census table.
+    """
+    extra = ''.join(f', {column}' for column in columns)
+    metadata = load_metadata(conn)
+    if year is None:
+        year = int(metadata['years'].split(',')[-1]) if metadata.get('years') else 10
+
+    if metadata.get('schema_version') == str(SCHEMA_VERSION):
+        return pd.read_sql('SELECT pop_fips, STNAME, COUNTY_KEY, TOT_POP' + extra + ' FROM county_population '
+                           'WHERE YEAR = ? AND AGEGRP = ?;',
+                           con = conn, params = (year, agegrp), index_col = 'pop_fips')
+
+    if crosswalk is None:
+        crosswalk = load_crosswalk(conn)
+
+    # might as well resort to SQL yelling bc names are all in caps
+    pop = pd.read_sql('SELECT STATE, COUNTY, TOT_POP' + extra + ' FROM census '
+                      'WHERE YEAR = ? AND AGEGRP = ? AND COUNTY_KEY IS NOT NULL;',
+                      con = conn, params = (year, agegrp))
+
+    # All cases for the five boroughs of New York City
+    # (New York, Kings, Queens, Bronx and Richmond counties)
+    # are assigned to a single area called New York City.
+    return (pop
+            .assign(fips = lambda x: x['STATE'] * 1000 + x['COUNTY'])
+            .merge(crosswalk[['fips', 'pop_fips', 'STNAME', 'COUNTY_KEY']], on = 'fips')
+            .groupby('pop_fips')
+            .aggregate({'STNAME': 'first', 'COUNTY_KEY': 'first', 'TOT_POP': 'sum',
+                        **{column: 'first' for column in columns}})
+           )
@@ -0,0 +1,269 @@
+# The Altair charts, shared by the ETL scripts, the publish job and the chart data server.
+#
+# Each chart takes its data either as a frame or as a URL to fetch the same records from (see
+# covid_etl/server.py), and uses the pipeline's column names with readable titles.  CHART_FILTERS
+# are the rows each chart shows, applied to the data before it's handed over: rows with a
+# quality_flags bit set (see covid_etl/quality.py) are always left out.  The marked counties are the
+# exception, they're drawn from annotations(), the unfiltered rows, and labelled in grey if flagged.
+#
+# save() and embed() render a chart with its data in a sidecar file instead of inline in the spec:
+# each dataset is trimmed to the columns the charts actually read, written once as CSV (plus a
+# gzipped copy for servers that serve precompressed files) under a name derived from its content,
+# and referenced by URL, so charts and pages that share a dataset share one file.  The files go in a
+# chart_data/ directory of their own next to the page, with a _pages.json of which page uses which,
+# and a rewritten page removes the files no page references any more.  altair is only imported once a
+# chart is built or rendered, the ETLs can import this module without it.
+
+import gzip
+import hashlib
+import json
+import os
+import re
+
+# sidecar directory next to a page, only ever holds chart data so it can be deployed as it is
+DATA_DIR = 'chart_data'
+PAGES_FILE = '_pages.json'
+
+# the content-named files _write_dataset() writes, the only ones prune() will remove
+SIDECAR_FILE = re.compile(r'^[0-9a-f]{16}\.csv(\.gz)?$')
+
+CHART_FILTERS = {
+    'capacity_vs_case_delta': 'quality_flags == 0 and free_bed_perc > -10',
+    'case_load_vs_case_delta': 'quality_flags == 0 and cases_new_per1k_sum14 > 0',
+}
+
+
+# counties marked by name on the case load chart
+MARKED_COUNTIES = {'King, Washington': 'King'}
+
+
+def chart_data(name, frame):
+    """The rows of `frame` that chart `name` shows."""
+    return frame.query(CHART_FILTERS[name])
+
+
+def annotations(frame):
+    """The rows of `frame` for the marked counties, whether or not the chart filters would keep them."""
+    return frame[frame['county_label'].isin(list(MARKED_COUNTIES))]
+
+
+def capacity_vs_case_delta(data):
+    import altair as alt
+
+    return (alt.Chart(data)
+            .mark_point()
+            .encode(x = alt.X('wkly_diff:Q', axis = alt.Axis(title = 'Week-over-week New Case Delta')),
+                    y = alt.Y('free_bed_perc:Q', axis = alt.Axis(title = 'Open Beds / Available Beds')),
+                    color = alt.Color('region:N', legend = alt.Legend(title = 'Region')),
+                    size = alt.Size('TOT_POP:Q', legend = alt.Legend(title = 'Population')),
+                    tooltip = ['county_label:N', 'TOT_POP:Q', 'free_bed_perc:Q'])
+            .interactive()
+            .properties(height = 400,
+                        width = 750,
+                        title = ['Estimated Bed Capacity vs Weekly Change in New Cases',
+                                 'US counties > 100,000 residents'])
+           )
+
+
+def case_load_vs_case_delta(data, marked = None):
+    """The case load chart of `data`, with the MARKED_COUNTIES labelled from `marked` (default `data`).
+
+    Pass annotations() of the unfiltered snapshot as `marked`, so a marked county that the chart filters
+    leave out is still labelled, in grey.
+    """
+    import altair as alt
+
+    brush = alt.selection_interval(empty = 'none')
+
+    base = alt.Chart(data)
+
+    cases_vs_case_delta_filter = (base.mark_point()
+     .encode(x = alt.X('wkly_diff:Q', axis = alt.Axis(title = 'Week-over-week Proportional Change')),
+             y = alt.Y('cases_new_per1k_sum14:Q', axis = alt.Axis(title = 'Current Cases per 1000')),
+             color = alt.Color('region:N', legend = alt.Legend(title = 'Region')),
+             size = alt.Size('TOT_POP:Q', legend = alt.Legend(title = 'Population')),
+             tooltip = [alt.Tooltip('county_label:N', title = 'County'),
+                        alt.Tooltip('cases_new_sum14:Q', title = 'Current Cases'),
+                        alt.Tooltip('TOT_POP:Q', title = 'Population')])
+     .add_selection(brush)
+     .properties(height = 400,
+                 width = 450,
+                 title = ['Estimated Current Case Load vs Weekly Change in New Cases',
+                          'US counties > 100,000 residents'])
+    )
+
+    marked_base = base if marked is None else alt.Chart(marked)
+    king = (marked_base
+     .transform_filter(alt.FieldOneOfPredicate(field = 'county_label', oneOf = list(MARKED_COUNTIES)))
+     .transform_calculate(label = '"- " + ' + json.dumps(MARKED_COUNTIES) + '[datum.county_label]')
+     .mark_text(dx = 30, font = 'Helvetica', filled = True, size = 20)
+     .encode(x = alt.X('wkly_diff:Q', axis = alt.Axis(title = 'Week-over-week Proportional Change')),
+             y = alt.Y('cases_new_per1k_sum14:Q', axis = alt.Axis(title = 'Current Cases per 1000')),
+             text = 'label:N',
+             # grey if the quality checks flagged it, i.e. its point isn't on the chart
+             color = alt.condition('datum.quality_flags > 0', alt.value('grey'), alt.value('black')),
+             tooltip = [alt.Tooltip('county_label:N', title = 'County'),
+                        alt.Tooltip('quality_flags:Q', title = 'Quality flags')]
+            )
+    )
+
+    cases_bar = (base.mark_bar(opacity = .5)
+     .encode(x = alt.X('cases_new_per1k_sum14:Q', axis = alt.Axis(title = 'Current Cases per 1000')),
+             y = alt.Y('county_label:N',
+                       axis = alt.Axis(labels = False, title = 'County'),
+                       sort = alt.EncodingSortField(field = 'cases_new_per1k_sum14', order = 'descending')),
+             color = alt.Color('region:N')
+             )
+     .transform_filter(brush)
+     .properties(height = 400,
+                 width = 250,
+                 title = 'Selected County Prevalence')
+    )
+
+    labels = (cases_bar.mark_text(align = 'right', baseline = 'middle')
+              .encode(text = 'county_label:N')
+    )
+
+    return (cases_vs_case_delta_filter + king) | (cases_bar + labels).resolve_scale(y = 'independent')
+
+
+CHARTS = {'capacity_vs_case_delta': capacity_vs_case_delta,
+          'case_load_vs_case_delta': case_load_vs_case_delta}
+
+
+def _fields(spec):
+    """Every column a Vega-Lite spec reads, from field definitions and datum.<column> in expressions."""
+    fields = set()
+
+    def visit(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == 'field' and isinstance(value, str):
+                    fields.add(value)
+                else:
+                    visit(value)
+        elif isinstance(node, list):
+            for value in node:
+                visit(value)
+        elif isinstance(node, str):
+            fields.update(re.findall(r'datum\.(\w+)', node))
+            fields.update(re.findall(r'datum\[[\'"]([^\'"]+)[\'"]\]', node))
+
+    visit(spec)
+    return fields
+
+
+def _write_dataset(records, fields, data_dir):
+    import pandas as pd
+
+    frame = pd.DataFrame.from_records(records)
+    frame = frame[[column for column in frame.columns if column in fields]]
+    content = frame.to_csv(index = False, float_format = '%.6g').encode()
+
+    name = hashlib.sha1(content).hexdigest()[:16] + '.csv'
+    path = os.path.join(data_dir, name)
+    # content-addressed, a dataset that's already there is the same data
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok = True)
+        # mtime 0 so the same data always gzips to the same bytes (gzip.compress() only takes it from 3.8)
+        with open(path + '.gz', 'wb') as f, gzip.GzipFile(fileobj = f, mode = 'wb', compresslevel = 9, mtime = 0) as gz:
+            gz.write(content)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    parse = {column: 'number' for column, dtype in frame.dtypes.items() if dtype.kind in 'iuf'}
+    return name, {'type': 'csv', 'parse': parse}
+
+
+def _read_pages(data_dir):
+    try:
+        with open(os.path.join(data_dir, PAGES_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def prune(data_dir, page, files):
+    """Record that `page` uses the sidecar `files` in `data_dir`, and remove the ones no page uses any more."""
+    pages = _read_pages(data_dir)
+    pages[page] = sorted(files)
+    used = {name for names in pages.values() for name in names}
+
+    path = os.path.join(data_dir, PAGES_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(pages, f, indent = 2, sort_keys = True)
+    os.replace(path + '.tmp', path)
+
+    removed = 0
+    for name in os.listdir(data_dir):
+        if SIDECAR_FILE.match(name) and name.replace('.gz', '') not in used:
+            os.remove(os.path.join(data_dir, name))
+            removed += 1
+    return removed
+
+
+def _externalize(chart, data_dir, url_prefix):
+    """Vega-Lite spec of `chart` with its datasets written to `data_dir`, and the names of the files."""
+    import altair as alt
+
+    # the data is going to a file, the inline row limit doesn't apply
+    with alt.data_transformers.enable('default', max_rows = None):
+        spec = chart.to_dict()
+
+    datasets = spec.pop('datasets', {})
+    fields = _fields(spec)
+    urls = {}
+    files = set()
+    for name, records in datasets.items():
+        file_name, data_format = _write_dataset(records, fields, data_dir)
+        urls[name] = {'url': url_prefix + file_name, 'format': data_format}
+        files.add(file_name)
+
+    def replace(node):
+        if isinstance(node, dict):
+            if 'name' in node and node.get('name') in urls and set(node) == {'name'}:
+                return urls[node['name']]
+            return {key: replace(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [replace(value) for value in node]
+        return node
+
+    return replace(spec), files
+
+
+def externalize(chart, data_dir, url_prefix = DATA_DIR + '/'):
+    """Vega-Lite spec of `chart` with its datasets written to `data_dir` and referenced as `url_prefix` + file name."""
+    return _externalize(chart, data_dir, url_prefix)[0]
+
+
+def _html(spec, fullhtml, output_div = 'vis'):
+    import altair as alt
+    from altair.utils.html import spec_to_html
+
+    return spec_to_html(spec, mode = 'vega-lite', vega_version = alt.VEGA_VERSION,
+                        vegaembed_version = alt.VEGAEMBED_VERSION, vegalite_version = alt.VEGALITE_VERSION,
+                        output_div = output_div, fullhtml = fullhtml,
+                        # a fragment has to load vega itself, inside a notebook or a page template
+                        **({} if fullhtml else {'template': 'universal'}))
+
+
+def save(chart, path, data_dir = None):
+    """Write `chart` to an HTML page at `path`, its data in sidecar files under `chart_data/` next to it."""
+    page_dir = os.path.dirname(os.path.abspath(path))
+    data_dir = data_dir or os.path.join(page_dir, DATA_DIR)
+    url_prefix = os.path.relpath(data_dir, page_dir).replace(os.sep, '/') + '/'
+    spec, files = _externalize(chart, data_dir, url_prefix)
+    with open(path, 'w') as f:
+        f.write(_html(spec, fullhtml = True))
+    prune(data_dir, os.path.relpath(os.path.abspath(path), data_dir), files)
+
+
+def embed(chart, data_dir, url_prefix = DATA_DIR + '/', output_div = 'vis', page = None):
+    """HTML fragment (div and script) rendering `chart` from sidecar data, to put in a notebook or page.
+
+    With `page`, the path of the page it goes in, sidecars no page uses any more are removed as in save().
+    """
+    spec, files = _externalize(chart, data_dir, url_prefix)
+    if page is not None:
+        prune(data_dir, os.path.relpath(os.path.abspath(page), data_dir), files)
+    return _html(spec, fullhtml = False, output_div = output_div)
@@ -0,0 +1,151 @@
+# File exports of the county frames for downstream consumers.
+#
+# write_ndjson() writes one JSON record per line, a county at a time from a generator rather than
+# one giant string, grouped by county and with a small <file>.index.json of where each county's
+# lines start, so a reader can seek straight to one county.  write_partitions() writes one file per
+# date (Parquet, or split-orient JSON) and keeps a hash of each day's rows in a manifest, so a rerun
+# only rewrites the days whose data changed - usually just the newest few.
+
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_FILE = '_manifest.json'
+
+BATCH_ROWS = 50000
+
+FORMATS = {'parquet': '.parquet', 'json': '.json'}
+
+
+def _atomic_write(path, content):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+
+
+def iter_ndjson(frame, by = 'county_label', batch_rows = BATCH_ROWS):
+    """(county, its rows as NDJSON) for each county in `frame`, in order.
+
+    Rows are serialized a batch of whole counties at a time, about `batch_rows` rows, which is as
+    fast as one to_json() of everything without ever holding all of it as one string.
+    """
+    codes, uniques = pd.factorize(frame[by], sort = True)
+    order = np.argsort(codes, kind = 'stable')
+    # rows with no county, like groupby, are left out
+    order = order[codes[order] >= 0]
+    ends = np.cumsum(np.bincount(codes[codes >= 0], minlength = len(uniques)))
+
+    county = start = 0
+    while county < len(uniques):
+        last = max(int(np.searchsorted(ends, start + batch_rows, side = 'right')), county + 1)
+        lines = (frame.iloc[order[start:ends[last - 1]]]
+                 .to_json(orient = 'records', lines = True, date_format = 'iso', double_precision = 6)
+                 .split('\n'))
+        # a JSON string can't hold a raw newline, so every one ends a record
+        line = 0
+        for county in range(county, last):
+            count = ends[county] - (ends[county - 1] if county else 0)
+            yield uniques[county], '\n'.join(lines[line:line + count]) + '\n'
+            line += count
+        county, start = last, ends[last - 1]
+
+
+def write_ndjson(frame, path, by = 'county_label'):
+    """Stream `frame` to `path` as NDJSON grouped by `by`, plus `path`.index.json of {county: [offset, length]}."""
+    index = {}
+    with open(path + '.tmp', 'wb') as f:
+        for key, lines in iter_ndjson(frame, by):
+            content = lines.encode()
+            index[str(key)] = [f.tell(), len(content)]
+            f.write(content)
+    os.replace(path + '.tmp', path)
+    _atomic_write(path + '.index.json', json.dumps(index).encode())
+    return len(index)
+
+
+def read_ndjson_county(path, county):
+    """One county's rows from a write_ndjson() file, without reading the rest of it."""
+    with open(path + '.index.json') as f:
+        offset, length = json.load(f)[county]
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return pd.read_json(io.BytesIO(f.read(length)), lines = True)
+
+
+def _partition_path(directory, date, format):
+    return os.path.join(directory, date.strftime('%Y-%m-%d') + FORMATS[format])
+
+
+def _digest(columns, row_hashes):
+    digest = hashlib.sha1(','.join(map(str, columns)).encode())
+    digest.update(row_hashes.tobytes())
+    return digest.hexdigest()
+
+
+def write_partitions(frame, directory, format = 'parquet', date = 'date'):
+    """One file per date under `directory`, rewriting only the dates whose rows changed since the last run.
+
+    Returns the number of partitions written, left as they were, and removed (dates no longer in `frame`).
+    """
+    if format not in FORMATS:
+        raise ValueError(f'unknown partition format {format!r}, expected one of {sorted(FORMATS)}')
+    os.makedirs(directory, exist_ok = True)
+
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get('format') != format:
+        manifest = {'format': format, 'partitions': {}}
+    previous = manifest['partitions']
+
+    # every row hashed in one pass, a day's rows are only gathered into a frame if its hash changed
+    row_hashes = pd.util.hash_pandas_object(frame, index = False).to_numpy()
+
+    partitions = {}
+    written = unchanged = 0
+    for day, positions in sorted(frame.groupby(date).indices.items()):
+        day = pd.Timestamp(day)
+        name = day.strftime('%Y-%m-%d')
+        path = _partition_path(directory, day, format)
+        partitions[name] = _digest(frame.columns, row_hashes[positions])
+        if previous.get(name) == partitions[name] and os.path.exists(path):
+            unchanged += 1
+            continue
+
+        rows = frame.iloc[positions]
+
+        if format == 'parquet':
+            rows.to_parquet(path + '.tmp', index = False)
+            os.replace(path + '.tmp', path)
+        else:
+            _atomic_write(path, rows.to_json(orient = 'split', index = False, date_format = 'iso',
+                                             double_precision = 6).encode())
+        written += 1
+
+    removed = 0
+    for name in set(previous) - set(partitions):
+        path = _partition_path(directory, pd.Timestamp(name), format)
+        if os.path.exists(path):
+            os.remove(path)
+        removed += 1
+
+    # written last, a run that dies part way just rewrites the same partitions next time
+    _atomic_write(manifest_path, json.dumps({'format': format, 'partitions': partitions}, indent = 2).encode())
+    return written, unchanged, removed
+
+
+def read_partition(directory, date):
+    """One day's rows from a write_partitions() directory."""
+    with open(os.path.join(directory, MANIFEST_FILE)) as f:
+        format = json.load(f)['format']
+    path = _partition_path(directory, pd.Timestamp(date), format)
+    if format == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_json(path, orient = 'split', convert_dates = ['date'])
@@ -0,0 +1,88 @@
+# FIPS crosswalk between the NYT county codes and the census counties we take population from.
+#
+# The NYT data mostly carries county FIPS codes, but it doesn't line up one-to-one with the census
+# file: the five boroughs of New York City are reported as a single area with no code, and cities
+# like St. Louis and Baltimore that are administered separately from an adjacent county of the same
+# name are reported on their own.  The crosswalk maps every NYT code to the census county (or NYC
+# rollup) it's joined to, so the join is an integer lookup instead of cleaning names row by row.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# not a real FIPS code - stands in for the NYT "New York City" area and the census rollup of its boroughs
+NYC_FIPS = 36998
+NYC_BOROUGHS = 'New York|Kings|Queens|Bronx|Richmond'
+
+CROSSWALK_COLUMNS = ['fips', 'pop_fips', 'STNAME', 'COUNTY_KEY']
+
+
+# in NYT data - "Cities like St. Louis and Baltimore that are administered separately from an adjacent
+# county of the same name are counted separately."
+# strip off the -city to find the surrounding county to join to the county-level census data
+def rm_city(county_name):
+    if re.search(r'(?<!new york)\scity', county_name):
+        return re.sub(r'([A-Za-z\s\.\-\']*)(\scity)', r'\1', county_name)
+    else:
+        return(county_name)
+
+
+def build_crosswalk(census):
+    """Crosswalk from census rows with STATE, COUNTY, STNAME, CTYNAME and the lowercase COUNTY_KEY from census_etl.py."""
+    counties = (census[['STATE', 'COUNTY', 'STNAME', 'CTYNAME', 'COUNTY_KEY']]
+                .drop_duplicates(['STATE', 'COUNTY'])
+                .assign(fips = lambda x: x['STATE'] * 1000 + x['COUNTY']))
+
+    # every keyed county joins to itself, except the boroughs that share the 'new york city' key
+    keyed = counties.dropna(subset = ['COUNTY_KEY'])
+    keyed = keyed.assign(pop_fips = keyed.groupby(['STNAME', 'COUNTY_KEY'])['fips'].transform('min'))
+    keyed.loc[keyed['COUNTY_KEY'].eq('new york city') & keyed['STNAME'].eq('New York'), 'pop_fips'] = NYC_FIPS
+
+    # independent cities have no key in the census file, join them to the county of the same name (if any)
+    cities = counties[counties['COUNTY_KEY'].isna() & counties['CTYNAME'].str.lower().str.endswith(' city')]
+    cities = (cities
+              .assign(COUNTY_KEY = lambda x: x['CTYNAME'].str.lower().map(rm_city))
+              .merge(keyed[['STNAME', 'COUNTY_KEY', 'pop_fips']].drop_duplicates(), on = ['STNAME', 'COUNTY_KEY']))
+
+    nyc = pd.DataFrame({'fips': [NYC_FIPS], 'pop_fips': [NYC_FIPS],
+                        'STNAME': ['New York'], 'COUNTY_KEY': ['new york city']})
+
+    return (pd.concat([keyed[CROSSWALK_COLUMNS], cities[CROSSWALK_COLUMNS], nyc], ignore_index = True)
+            .astype({'fips': np.int32, 'pop_fips': np.int32})
+            .sort_values('fips')
+            .reset_index(drop = True))
+
+
+def assign_pop_fips(cases, crosswalk):
+    """Add `pop_fips`, the census county each NYT row joins to (-1 where there isn't one)."""
+    fips = cases['fips'].to_numpy(dtype = np.float64, na_value = np.nan)
+
+    # NYT leaves the fips blank for New York City
+    nyc = np.isnan(fips) & cases['county'].eq('New York City').to_numpy() & cases['state'].eq('New York').to_numpy()
+    fips[nyc] = NYC_FIPS
+
+    lookup = np.full(100000, -1, dtype = np.int32)
+    lookup[crosswalk['fips'].to_numpy()] = crosswalk['pop_fips'].to_numpy()
+
+    known = ~np.isnan(fips)
+    pop_fips = np.full(len(cases), -1, dtype = np.int32)
+    pop_fips[known] = lookup[fips[known].astype(np.int64)]
+
+    cases['pop_fips'] = pop_fips
+    return cases
+
+
+def join_population(cases, population):
+    """Inner join on `pop_fips` against a population frame indexed by it, as array lookups."""
+    position = population.index.get_indexer(cases['pop_fips'])
+    matched = position >= 0
+    cases = cases[matched].copy()
+    position = position[matched]
+
+    for column in population.columns:
+        # take from the array so categorical columns stay categorical
+        cases[column] = population[column].array.take(position)
+    # the lowercase join key the rest of the ETL (e.g. the hospital bed join) works with
+    cases['county_key'] = cases['COUNTY_KEY']
+    return cases
@@ -0,0 +1,105 @@
+# Streaming reader for the ArcGIS hospitals GeoJSON.
+#
+# The feature collection is tens of MB of JSON, nearly all of it geometry and properties we don't
+# use.  Rather than json.load() the whole thing and build a frame of every facility, we decode one
+# feature at a time out of a rolling text buffer and add its beds to a running per-county total,
+# so memory is bounded by the number of counties rather than the size of the file.
+
+import codecs
+import json
+
+import pandas as pd
+
+# acute/ICU capacity, the rest (psychiatric, rehab, long term care...) doesn't take covid patients
+BED_TYPES = ('GENERAL ACUTE CARE', 'CRITICAL ACCESS')
+
+# ArcGIS uses -999 for "not available"
+MISSING_BEDS = -999
+
+CHUNK_SIZE = 1 << 20
+
+
+def file_chunks(path, chunk_size = CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+
+def iter_features(chunks):
+    """Yield the features of a GeoJSON FeatureCollection one at a time from an iterable of byte chunks."""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    eof = False
+
+    def more():
+        nonlocal buf, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buf = buf[pos:] + text.decode(b'', final = True)
+        else:
+            # drop what's already been decoded so the buffer stays around one chunk long
+            buf = buf[pos:] + text.decode(chunk)
+        pos = 0
+
+    # skip ahead to the opening bracket of the features array
+    while True:
+        start = buf.find('"features"', pos)
+        if start >= 0:
+            bracket = buf.find('[', start)
+            if bracket >= 0:
+                pos = bracket + 1
+                break
+        if eof:
+            return
+        more()
+
+    while True:
+        # separators between features
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                return
+            more()
+            continue
+        if buf[pos] == ']':
+            return
+
+        try:
+            feature, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # feature runs past the end of the buffer
+            if eof:
+                raise
+            more()
+            continue
+
+        pos = end
+        yield feature
+
+
+def iter_properties(chunks, columns = ('STATE', 'COUNTY', 'TYPE', 'BEDS')):
+    """Just the `columns` of each feature's properties."""
+    for feature in iter_features(chunks):
+        properties = feature.get('properties') or {}
+        yield tuple(properties.get(column) for column in columns)
+
+
+def county_beds(chunks, bed_types = BED_TYPES):
+    """Total beds per (STATE, COUNTY) over the facilities of `bed_types`, aggregated as the features stream by."""
+    beds = {}
+    for state, county, facility_type, facility_beds in iter_properties(chunks):
+        if facility_type not in bed_types or facility_beds is None or facility_beds == MISSING_BEDS:
+            continue
+        if state is None or county is None:
+            continue
+        beds[state, county] = beds.get((state, county), 0) + facility_beds
+
+    return (pd.DataFrame([(state, county, total) for (state, county), total in beds.items()],
+                         columns = ['STATE', 'COUNTY', 'BEDS'])
+            .sort_values(['STATE', 'COUNTY'])
+            .reset_index(drop = True))
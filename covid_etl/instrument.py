@@ -0,0 +1,114 @@
+# Stage timing and profiling for the ETLs.
+#
+# Every pipeline stage (and anything else wrapped in `timed`) can emit one JSON line with its wall
+# time, rows in and out, the memory of the frame it produced, and the process's current and peak
+# RSS, so a run's log shows where the time and memory went and runs can be compared as the NYT file
+# grows.  Optionally each stage is also run under cProfile and dumped to <profile_dir>/<stage>.prof,
+# which snakeviz or flameprof turn into a flame graph.  Both are off unless configured, either with
+# configure() or the COVID_ETL_STAGE_LOG ('-' for stderr) and COVID_ETL_PROFILE_DIR variables.
+
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import sys
+import time
+
+_log = None
+_profile_dir = None
+_profiling = False
+
+
+def configure(log = None, profile_dir = None):
+    """Send stage records to `log` (a path to append to, or '-' for stderr) and/or profiles to `profile_dir`."""
+    global _log, _profile_dir
+    if _log not in (None, sys.stderr):
+        _log.close()
+    _log = sys.stderr if log == '-' else open(log, 'a') if log else None
+    _profile_dir = profile_dir
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok = True)
+
+
+def enabled():
+    return _log is not None or _profile_dir is not None
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _rows(value):
+    if hasattr(value, 'memory_usage') and hasattr(value, '__len__'):
+        return len(value)
+    if isinstance(value, dict):
+        # e.g. the census stage's crosswalk and population frames
+        rows = [_rows(item) for item in value.values()]
+        return sum(rows) if rows and None not in rows else None
+    return None
+
+
+def _frame_mb(value):
+    if hasattr(value, 'memory_usage'):
+        return float(value.memory_usage(deep = True).sum()) / 2 ** 20
+    if isinstance(value, dict):
+        sizes = [_frame_mb(item) for item in value.values()]
+        return sum(sizes) if sizes and None not in sizes else None
+    return None
+
+
+@contextlib.contextmanager
+def timed(name, inputs = (), **fields):
+    """Time the block as stage `name`.  Set `record['output']` in the block to also count its rows and memory."""
+    global _profiling
+    record = {'stage': name, **fields}
+    if not enabled():
+        yield record
+        return
+
+    # only the outermost block is profiled, cProfile can't nest
+    profiler = cProfile.Profile() if _profile_dir and not _profiling else None
+    rows_in = [_rows(value) for value in inputs]
+    start = time.perf_counter()
+    if profiler is not None:
+        _profiling = True
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profiling = False
+            profiler.dump_stats(os.path.join(_profile_dir, f'{name}.prof'))
+
+        elapsed = time.perf_counter() - start
+        output = record.pop('output', None)
+        record.update({'time': datetime.datetime.now().isoformat(timespec = 'seconds'),
+                       'wall_s': round(elapsed, 4),
+                       'rows_in': sum(rows_in) if inputs and None not in rows_in else None,
+                       'rows_out': _rows(output),
+                       'frame_mb': _frame_mb(output),
+                       'rss_mb': _rss_mb(),
+                       'peak_rss_mb': _peak_rss_mb()})
+        if _log is not None:
+            _log.write(json.dumps({key: round(value, 2) if isinstance(value, float) and key != 'wall_s' else value
+                                   for key, value in record.items()}, default = str) + '\n')
+            _log.flush()
+
+
+configure(os.environ.get('COVID_ETL_STAGE_LOG'), os.environ.get('COVID_ETL_PROFILE_DIR'))
@@ -0,0 +1,211 @@
+# Vectorized per-county kernels.
+#
+# Everything here works on plain NumPy arrays laid out in group order: sort once by the county key
+# (stable, so rows keep their date order within a county), mark where each county block starts,
+# and do the arithmetic with resets at those boundaries.  This replaces the pattern of one
+# groupby().shift() or groupby().transform(lambda x: x.rolling(n)...) pass per column.
+
+import numpy as np
+import pandas as pd
+
+
+class Groups:
+    """Sort order that makes each group contiguous, plus a mask of the group starts in that order."""
+
+    def __init__(self, df, by):
+        if isinstance(by, str):
+            by = [by]
+
+        # combine the per-key codes into one int64 code, rows with a missing key get -1 like groupby drops them
+        codes = np.zeros(len(df), dtype = np.int64)
+        missing = np.zeros(len(df), dtype = bool)
+        for key in by:
+            key_codes, uniques = pd.factorize(df[key])
+            codes = codes * (len(uniques) + 1) + key_codes
+            missing |= key_codes < 0
+        if len(by) > 1:
+            # back down to dense codes, the product of the key cardinalities is mostly empty
+            codes = pd.factorize(codes)[0]
+        codes[missing] = -1
+
+        # shifted so missing keys sort first, and narrowed when it fits so NumPy can use its radix sort
+        codes += 1
+        if codes.max(initial = 0) < np.iinfo(np.uint16).max:
+            codes = codes.astype(np.uint16)
+        self.order = np.argsort(codes, kind = 'stable')
+        sorted_codes = codes[self.order]
+
+        # frames that are already grouped (e.g. sorted by county and date) skip the reordering entirely
+        if (self.order[1:] > self.order[:-1]).all():
+            self.order = None
+
+        self.starts = np.ones(len(df), dtype = bool)
+        self.starts[1:] = sorted_codes[1:] != sorted_codes[:-1]
+        # each row with a missing key is a group of its own
+        self.starts |= sorted_codes == 0
+
+        # position of each row within its group, a rolling window is complete once it reaches window - 1
+        start_idx = np.flatnonzero(self.starts)
+        self.position = np.arange(len(df)) - np.repeat(start_idx, np.diff(np.append(start_idx, len(df))))
+
+    def take(self, values):
+        values = np.asarray(values)
+        return values if self.order is None else values[self.order]
+
+    def put(self, sorted_values):
+        if self.order is None:
+            return sorted_values
+        out = np.empty_like(sorted_values)
+        out[self.order] = sorted_values
+        return out
+
+    def lag(self, sorted_values):
+        """Previous value within the group, 0 at group starts (same as shift(1).fillna(0).astype(int))."""
+        prev = np.empty_like(sorted_values)
+        prev[1:] = sorted_values[:-1]
+        prev[self.starts] = 0
+        if prev.dtype.kind == 'f':
+            prev[np.isnan(prev)] = 0
+        # int32 / float32 columns (see covid_etl/schema.py) keep their width
+        return prev.astype(np.int32 if prev.dtype.itemsize <= 4 else np.int64)
+
+
+def _float_dtype(values):
+    # floats derived from a column are as wide as the column, so compact frames stay compact
+    return np.float32 if values.dtype.itemsize <= 4 else np.float64
+
+
+def _new(values, prev):
+    return (values - prev).astype(values.dtype, copy = False)
+
+
+def _delta(values, prev):
+    # proportional change, x / 0 gives inf and 0 / 0 gives NaN just like the pandas version
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return ((values - prev) / prev).astype(_float_dtype(values), copy = False)
+
+
+def add_daily_new(df, metrics, by = ('county', 'state'), groups = None):
+    """From cumulative `metrics` add `<m>_shifted` (previous day) and `<m>_new` (daily new)."""
+    groups = groups or Groups(df, list(by))
+    for metric in metrics:
+        values = groups.take(df[metric])
+        prev = groups.lag(values)
+        df[f'{metric}_shifted'] = groups.put(prev)
+        df[f'{metric}_new'] = groups.put(_new(values, prev))
+    return df
+
+
+def add_day_over_day(df, columns, by = ('county', 'state'), groups = None):
+    """Add `<c>_shifted` (previous day) and `<c>_delta` (proportional day-over-day change) for `columns`."""
+    groups = groups or Groups(df, list(by))
+    for column in columns:
+        values = groups.take(df[column])
+        prev = groups.lag(values)
+        df[f'{column}_shifted'] = groups.put(prev)
+        df[f'{column}_delta'] = groups.put(_delta(values, prev))
+    return df
+
+
+def add_diffs(df, metrics, by = ('county', 'state')):
+    """Daily new and day-over-day delta columns for cumulative `metrics`, sorting once for all of them."""
+    groups = Groups(df, list(by))
+    add_daily_new(df, metrics, groups = groups)
+    add_day_over_day(df, [f'{metric}_new' for metric in metrics], groups = groups)
+    return df
+
+
+def add_rolling(df, specs, by = 'county_label', groups = None):
+    """Grouped rolling sums/means for a list of `(output, column, window, 'sum' | 'mean')` specs.
+
+    Matches `groupby(by)[column].transform(lambda x: x.rolling(window).sum())` (or .mean()): NaN until the
+    window is full, and NaN if anything in the window is NaN or +/-inf (pandas treats inf as missing in
+    rolling windows, which is what keeps the inf from `cases_new_delta` out of its moving averages).
+    Each input column gets one cumulative-sum pass no matter how many windows are taken from it, always
+    accumulated in 64 bits; outputs are float32 for 32-bit inputs and float64 otherwise.
+    """
+    groups = groups or Groups(df, by)
+    index = np.arange(len(df))
+
+    by_column = {}
+    for output, column, window, how in specs:
+        by_column.setdefault(column, []).append((output, window, how))
+
+    for column, windows in by_column.items():
+        values = groups.take(df[column])
+        dtype = _float_dtype(values)
+
+        if values.dtype.kind in 'iub':
+            # integer counts sum exactly and are never missing
+            cumulative = np.concatenate([[0], np.cumsum(values, dtype = np.int64)])
+            missing = None
+        else:
+            values = values.astype(np.float64)
+            finite = np.isfinite(values)
+            cumulative = np.concatenate([[0.0], np.cumsum(np.where(finite, values, 0.0))])
+            missing = None if finite.all() else np.concatenate([[0], np.cumsum(~finite, dtype = np.int64)])
+
+        for output, window, how in windows:
+            start = np.maximum(index + 1 - window, 0)
+            result = (cumulative[index + 1] - cumulative[start]).astype(np.float64)
+
+            incomplete = groups.position < window - 1
+            if missing is not None:
+                incomplete |= missing[index + 1] - missing[start] > 0
+            result[incomplete] = np.nan
+
+            if how == 'mean':
+                result /= window
+            elif how != 'sum':
+                raise ValueError(f'unknown rolling statistic {how!r} for {output}')
+
+            df[output] = groups.put(result.astype(dtype, copy = False))
+
+    return df
+
+
+def add_week_over_week(df, column = 'cases_new', by = 'county_label', date = 'date', days = 7, groups = None,
+                       outputs = ('last_wk_cases', 'two_wks_ago_cases', 'wkly_diff')):
+    """Trailing `days`-day sums of `column` and their proportional change, for every row at once.
+
+    For a row dated d the outputs are the group's sum over [d - days, d), the sum over [d - 2 * days, d - days)
+    and (last - previous) / previous, the same as filtering both weeks, summing per group and inner-merging
+    for that one date: all three are NaN when the group has no rows in either week.  Each window is found by
+    binary search on a (group, day) key over one cumulative sum, so all dates cost about as much as one.
+    """
+    groups = groups or Groups(df, by)
+    last_output, previous_output, diff_output = outputs
+
+    values = groups.take(df[column])
+    dtype = _float_dtype(values)
+    day = groups.take(df[date]).astype('datetime64[D]').astype(np.int64)
+
+    # each group gets a band of the key wide enough that looking two windows back never reaches the group before
+    group_id = np.cumsum(groups.starts) - 1
+    day = day - day.min(initial = 0) + 2 * days
+    key = group_id * (day.max(initial = 0) + 1) + day
+
+    # rows of a group aren't necessarily in date order, sort them so the windows are contiguous
+    order = np.argsort(key, kind = 'stable')
+    sorted_key = key[order]
+    if values.dtype.kind in 'iub':
+        cumulative = np.concatenate([[0], np.cumsum(values[order], dtype = np.int64)])
+    else:
+        # groupby().sum() skips NaN
+        cumulative = np.concatenate([[0.0], np.cumsum(np.nan_to_num(values[order].astype(np.float64), nan = 0.0))])
+
+    end = np.searchsorted(sorted_key, key)
+    middle = np.searchsorted(sorted_key, key - days)
+    start = np.searchsorted(sorted_key, key - 2 * days)
+
+    last = (cumulative[end] - cumulative[middle]).astype(np.float64)
+    previous = (cumulative[middle] - cumulative[start]).astype(np.float64)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        diff = (last - previous) / previous
+
+    empty = (end == middle) | (middle == start)
+    for output, result in [(last_output, last), (previous_output, previous), (diff_output, diff)]:
+        result[empty] = np.nan
+        df[output] = groups.put(result.astype(dtype, copy = False))
+
+    return df
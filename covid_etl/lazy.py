@@ -0,0 +1,62 @@
+# Reading only the part of the NYT snapshot the snapshot stage depends on.
+#
+# The charts only need the counties on the snapshot date, and every column they use looks back a fixed
+# number of days: the rolling windows, the two weeks of the week-over-week change, and the two weeks
+# before those that the quality checks compare each day with.  lookback_days() works that out from the
+# pipeline's params, and load_trailing() scans just those days with DuckDB: the query is planned lazily,
+# date partitions outside the range are never opened, and the date filter and column projection are
+# pushed into the Parquet scan.  stages.trailing_quality() then runs the usual stage functions on the
+# few weeks that come back instead of on the whole history, and the duckdb backend of the pipeline
+# takes its quality stage, quality report and snapshot from that.
+#
+# Windows are counted in rows, which is the same as days as long as a county reports every day - NYT
+# counties do once they first appear.  Needs `duckdb`.
+
+import datetime
+import os
+
+import pandas as pd
+
+from covid_etl import schema
+
+CASE_COLUMNS = ['date', 'county', 'state', 'fips', 'cases', 'deaths']
+
+# the week-over-week change compares the 7 days before a date with the 7 before that
+WEEK = 7
+
+
+def lookback_days(specs):
+    """How many days before the snapshot date the stages read, for rolling windows `specs`."""
+    windows = [int(window) for _, _, window, _ in specs]
+    # the quality checks look at the two weeks before the week-over-week change, each day against the
+    # two weeks before it; and a delta needs the day before it, whose new count needs the day before that
+    return max(windows + [2 * 2 * WEEK]) + 2
+
+
+def snapshot_files(snapshot_dir, start = None):
+    """Date partitions of the NYT snapshot from `start` on, found by name without opening any of them."""
+    names = sorted(name for name in os.listdir(snapshot_dir) if name.endswith('.parquet'))
+    if start is not None:
+        names = [name for name in names if name >= pd.Timestamp(start).strftime('%Y-%m-%d') + '.parquet']
+    return [os.path.join(snapshot_dir, name) for name in names]
+
+
+def load_trailing(snapshot_dir, days, columns = CASE_COLUMNS):
+    """Every row of the NYT snapshot dated from `days` days before its latest date, in NYT file order and
+    with the compact dtypes, like nyt.load_cases().
+    """
+    import duckdb
+
+    # file names are dates, the last one is the latest date without reading anything
+    latest = pd.Timestamp(os.path.basename(snapshot_files(snapshot_dir)[-1])[:10])
+    start = latest - datetime.timedelta(days = days)
+
+    conn = duckdb.connect()
+    try:
+        relation = (conn.read_parquet(snapshot_files(snapshot_dir, start))
+                    .filter(f"date >= TIMESTAMP '{start:%Y-%m-%d}'")
+                    .select(*columns))
+        cases = relation.df()
+    finally:
+        conn.close()
+    return schema.compact_cases(cases)
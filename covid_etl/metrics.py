@@ -0,0 +1,159 @@
+# Materialized daily county metrics and the query API the dashboards use.
+#
+# The pipeline's full-history output (per-capita rates, rolling windows, week-over-week change and
+# estimated free beds for every county and date) is written to a `county_daily_metrics` SQLite table
+# keyed on (fips, date), with an index on date.  Readers only ever query that table, so polling it
+# costs an index lookup and never runs the pipeline.  The table is rewritten only when the pipeline
+# key of its source stage changes, i.e. when there's new data or new code.  The metadata also keeps the
+# date of the pipeline's snapshot stage (a few days before the latest date, which is still filling in),
+# the date get_snapshot() and the chart data server default to.
+
+import datetime
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+METRICS_DB = os.environ.get('COVID_ETL_METRICS_DB',
+                            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                         'data', 'county_metrics.db'))
+
+TABLE = 'county_daily_metrics'
+
+# identify the county and date, everything else numeric in the frame is a metric
+ID_COLUMNS = ['fips', 'date', 'county', 'state', 'county_label', 'pop_fips', 'region', 'TOT_POP']
+
+
+def _sql_type(dtype):
+    if dtype.kind in 'iub':
+        return 'INTEGER'
+    if dtype.kind == 'f':
+        return 'REAL'
+    return 'TEXT'
+
+
+def metric_columns(frame):
+    """Numeric columns of a pipeline frame worth serving, i.e. not an id and not an intermediate lag."""
+    return [column for column, dtype in frame.dtypes.items()
+            if column not in ID_COLUMNS and not column.endswith('_shifted') and dtype.kind in 'iuf']
+
+
+def _write_metadata(conn, items):
+    conn.execute('CREATE TABLE IF NOT EXISTS metrics_metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);')
+    conn.executemany('INSERT OR REPLACE INTO metrics_metadata VALUES (?, ?);',
+                     [(key, value) for key, value in items if value is not None])
+    # a snapshot date that's no longer known shouldn't outlive the data it was for
+    conn.executemany('DELETE FROM metrics_metadata WHERE key = ?;', [(key,) for key, value in items if value is None])
+
+
+def write_county_daily_metrics(conn, frame, version, snapshot_date = None):
+    """Replace `county_daily_metrics` with `frame`, one row per county and date, tagged with `version`.
+
+    `snapshot_date` is the date readers get by default, the latest date in `frame` if not given.
+    """
+    frame = frame.assign(date = lambda x: x['date'].dt.strftime('%Y-%m-%d'))
+
+    columns = [column for column in ID_COLUMNS if column in frame] + metric_columns(frame)
+
+    # NaN / inf as NULL, numpy scalars as plain Python ones
+    values = frame[columns].replace([np.inf, -np.inf], np.nan).astype(object)
+    rows = values.where(values.notna(), None)
+
+    definitions = [f'"{column}" {_sql_type(frame[column].dtype)}' for column in columns]
+
+    with conn:
+        # all in one transaction, readers see the previous table until the new one is complete
+        conn.execute('BEGIN;')
+        conn.execute(f'DROP TABLE IF EXISTS {TABLE};')
+        conn.execute(f'CREATE TABLE {TABLE} ({", ".join(definitions)}, PRIMARY KEY (fips, date)) WITHOUT ROWID;')
+        conn.executemany(f'INSERT INTO {TABLE} VALUES ({", ".join("?" * len(columns))});',
+                         rows.itertuples(index = False, name = None))
+        # the snapshot query, every county on one date
+        conn.execute(f'CREATE INDEX {TABLE}_date ON {TABLE} (date, TOT_POP);')
+
+        _write_metadata(conn, [('version', version),
+                               ('created', datetime.datetime.now().isoformat(timespec = 'seconds')),
+                               ('max_date', frame['date'].max()),
+                               ('snapshot_date', snapshot_date),
+                               ('rows', str(len(frame)))])
+
+
+def load_metadata(conn):
+    try:
+        return dict(conn.execute('SELECT key, value FROM metrics_metadata;').fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+def _snapshot_date(frame):
+    return frame['date'].max().strftime('%Y-%m-%d') if len(frame) else None
+
+
+def publish(pipe, stage = 'daily_metrics', db = None, snapshot_stage = 'snapshot'):
+    """Write the output of `stage` to the metrics DB unless it already holds that version.  True if written.
+
+    The date of `snapshot_stage`'s output is stored as the snapshot date, updated on its own if only it moved.
+    """
+    db = db or METRICS_DB
+    os.makedirs(os.path.dirname(os.path.abspath(db)), exist_ok = True)
+    version = pipe.key(stage)
+    snapshot_date = _snapshot_date(pipe.get(snapshot_stage))
+
+    conn = sqlite3.connect(db)
+    try:
+        # WAL so the dashboards can keep reading while the table is rewritten
+        conn.execute('PRAGMA journal_mode = WAL;')
+        metadata = load_metadata(conn)
+        if metadata.get('version') == version:
+            if metadata.get('snapshot_date') == snapshot_date:
+                return False
+            # e.g. a different days_back, which doesn't change a single row of the table
+            with conn:
+                _write_metadata(conn, [('snapshot_date', snapshot_date)])
+            return True
+        write_county_daily_metrics(conn, pipe.get(stage), version, snapshot_date)
+    finally:
+        conn.close()
+    return True
+
+
+def _connect(db):
+    # read-only, a dashboard should never be able to lock out the nightly write for long
+    return sqlite3.connect(f'file:{db or METRICS_DB}?mode=ro', uri = True)
+
+
+def _query(sql, params, db):
+    conn = _connect(db)
+    try:
+        frame = pd.read_sql(sql, con = conn, params = params)
+    finally:
+        conn.close()
+    return frame.assign(date = lambda x: pd.to_datetime(x['date']))
+
+
+def get_snapshot_date(db = None):
+    """The pipeline's snapshot date as 'YYYY-MM-DD', or the latest date in the table for a DB written without one."""
+    conn = _connect(db)
+    try:
+        date = load_metadata(conn).get('snapshot_date')
+        if date is None:
+            date = conn.execute(f'SELECT MAX(date) FROM {TABLE};').fetchone()[0]
+    finally:
+        conn.close()
+    return date
+
+
+def get_snapshot(date = None, min_pop = 100000, db = None):
+    """Every county with more than `min_pop` residents on `date` (default the pipeline's snapshot date)."""
+    date = get_snapshot_date(db) if date is None else pd.Timestamp(date).strftime('%Y-%m-%d')
+
+    return _query(f'SELECT * FROM {TABLE} WHERE date = ? AND TOT_POP > ? ORDER BY county_label;', (date, min_pop), db)
+
+
+def get_county_series(fips, start = None, end = None, db = None):
+    """The daily history of one county by NYT FIPS code (covid_etl.fips.NYC_FIPS for New York City)."""
+    start = pd.Timestamp(start).strftime('%Y-%m-%d') if start is not None else '0000-00-00'
+    end = pd.Timestamp(end).strftime('%Y-%m-%d') if end is not None else '9999-99-99'
+    return _query(f'SELECT * FROM {TABLE} WHERE fips = ? AND date BETWEEN ? AND ? ORDER BY date;',
+                  (int(fips), start, end), db)
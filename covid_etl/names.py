@@ -0,0 +1,87 @@
+# County name normalization, done once per distinct name rather than once per row.
+#
+# The census file repeats every county name for each year and age group, so a regex over the
+# CTYNAME column runs hundreds of thousands of times for a few thousand distinct counties.  Here
+# the names are factorized first, cleaned once per distinct value and mapped back with an array
+# take.  The census join keys are also kept in a `county_names` table in the census database, so a
+# rerun (or a newer vintage of the estimates file) only cleans the names it hasn't seen before.
+
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import fips
+
+# bump when census_county_key changes, lookup rows written under another version are ignored
+RULES_VERSION = 1
+
+# the county name before " County" or " Parish" - independent cities ("Baltimore city") don't match
+COUNTY_KEY_PATTERN = re.compile(r'([A-Za-z\s\.\-\']*)(?=\sCounty|\sParish)')
+
+
+def normalize(values, func):
+    """`func` of each distinct value in `values`, mapped back onto every row.  Missing values stay missing."""
+    codes, uniques = pd.factorize(values)
+    normalized = np.array([func(value) for value in uniques] + [None], dtype = object)
+    # factorize codes missing values as -1, which picks the trailing None
+    return pd.Series(normalized[codes], index = getattr(values, 'index', None))
+
+
+def census_county_key(stname, ctyname):
+    """The lowercase key a census county joins to the NYT cases on, None for independent cities."""
+    # Manually fix a few County/district names so they join to the NYT cases dataset
+
+    # All cases for the five boroughs of New York City
+    # (New York, Kings, Queens, Bronx and Richmond counties)
+    # are assigned to a single area called New York City.
+    if stname == 'New York' and re.search(fips.NYC_BOROUGHS, ctyname):
+        return 'new york city'
+
+    # D.C
+    if ctyname == 'District of Columbia':
+        return 'district of columbia'
+
+    match = COUNTY_KEY_PATTERN.search(ctyname)
+    return match.group(1).lower() if match else None
+
+
+def county_keys(stname, ctyname, lookup = None):
+    """COUNTY_KEY for every census row, cleaning only the (STNAME, CTYNAME) pairs missing from `lookup`.
+
+    Returns the keys and the lookup with any new pairs added.
+    """
+    lookup = dict(lookup or {})
+    # factorize each column, then the pairs of codes, much cheaper than hashing tuples of strings
+    state_codes, states = pd.factorize(stname)
+    name_codes, county_names = pd.factorize(ctyname)
+    codes, pairs = pd.factorize(state_codes.astype(np.int64) * len(county_names) + name_codes)
+
+    keys = []
+    for pair in pairs:
+        pair = (states[pair // len(county_names)], county_names[pair % len(county_names)])
+        if pair not in lookup:
+            lookup[pair] = census_county_key(*pair)
+        keys.append(lookup[pair])
+
+    keys = np.array(keys, dtype = object)
+    return pd.Series(keys[codes], index = getattr(ctyname, 'index', None), name = 'COUNTY_KEY'), lookup
+
+
+def load_lookup(conn):
+    """(STNAME, CTYNAME) -> COUNTY_KEY from the census DB, empty if it has none yet."""
+    try:
+        rows = conn.execute('SELECT STNAME, CTYNAME, COUNTY_KEY FROM county_names WHERE rules_version = ?;',
+                            (RULES_VERSION,)).fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    return {(stname, ctyname): key for stname, ctyname, key in rows}
+
+
+def write_lookup(conn, lookup):
+    with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS county_names (STNAME TEXT NOT NULL, CTYNAME TEXT NOT NULL, '
+                     'COUNTY_KEY TEXT, rules_version INTEGER NOT NULL, PRIMARY KEY (STNAME, CTYNAME)) WITHOUT ROWID;')
+        conn.executemany('INSERT OR REPLACE INTO county_names VALUES (?, ?, ?, ?);',
+                         [(stname, ctyname, key, RULES_VERSION) for (stname, ctyname), key in lookup.items()])
@@ -0,0 +1,232 @@
+# Incremental ingest of the NYT us-counties file into a local Parquet snapshot.
+#
+# The snapshot is one Parquet file per date under SNAPSHOT_DIR, plus a small JSON metadata file
+# with the ETag/Last-Modified of the last download, the byte length of the source file and the
+# last few KB of it.  On refresh we send a conditional GET for only the bytes past what we already
+# have; if the server says 304 we're done, and if the bytes we already hold are unchanged we parse
+# just the appended rows and write just the new date partitions.  Anything else (history revised,
+# first run) falls back to a full download and rebuild.  A byte range can only vouch for the tail of
+# what we hold, so we also do a full rebuild every FULL_REFRESH_DAYS to pick up older revisions.
+#
+# The metadata's sha256 always covers the first `length` bytes, so a server that ignores Range can be
+# checked against everything we hold.  A 206 only has the new bytes, so the hash is chained: each
+# refresh hashes the previous digest plus the bytes it appended, and `segments` keeps where each one
+# ended.  A single segment (any full download) is just the sha256 of the file.
+
+import datetime
+import hashlib
+import io
+import json
+import os
+
+import pandas as pd
+
+from covid_etl import schema
+
+NYT_COUNTIES_URL = os.environ.get('NYT_COUNTIES_URL',
+                                  'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv')
+
+SNAPSHOT_DIR = os.environ.get('NYT_SNAPSHOT_DIR',
+                              os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                           'data', 'nyt_us_counties'))
+
+# how much of the previous download we keep around to check that it wasn't revised
+TAIL_BYTES = 4096
+
+FULL_REFRESH_DAYS = 7
+
+META_FILE = '_snapshot.json'
+TAIL_FILE = '_tail.bin'
+
+CSV_DTYPES = {'county': str, 'state': str, 'fips': 'Int32', 'cases': 'int64', 'deaths': 'float64'}
+
+
+def _read_meta(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, META_FILE)) as f:
+            meta = json.load(f)
+        with open(os.path.join(snapshot_dir, TAIL_FILE), 'rb') as f:
+            meta['tail'] = f.read()
+    except (OSError, ValueError):
+        return None
+    return meta
+
+
+def _write_meta(snapshot_dir, meta, tail):
+    # tail first, then the JSON - a run that dies in between just looks like a stale snapshot
+    _atomic_write(os.path.join(snapshot_dir, TAIL_FILE), tail)
+    _atomic_write(os.path.join(snapshot_dir, META_FILE), json.dumps(meta, indent = 2).encode())
+
+
+def _atomic_write(path, content):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def _partition_path(snapshot_dir, date):
+    return os.path.join(snapshot_dir, date.strftime('%Y-%m-%d') + '.parquet')
+
+
+def _parse(csv_bytes):
+    cases = pd.read_csv(io.BytesIO(csv_bytes), dtype = CSV_DTYPES)
+    return cases.assign(date = pd.to_datetime(cases['date']))
+
+
+def _write_partitions(snapshot_dir, cases, merge_existing = False):
+    # one file per date, written to a temp name and swapped in so a reader never sees half a day
+    for date, day in cases.groupby('date', sort = True):
+        path = _partition_path(snapshot_dir, date)
+        if merge_existing and os.path.exists(path):
+            day = pd.concat([pd.read_parquet(path), day], ignore_index = True)
+        day.to_parquet(path + '.tmp', index = False)
+        os.replace(path + '.tmp', path)
+
+
+def _clear_partitions(snapshot_dir):
+    for name in os.listdir(snapshot_dir):
+        if name.endswith('.parquet'):
+            os.remove(os.path.join(snapshot_dir, name))
+
+
+def _chain_hash(content, segments, digest = ''):
+    """sha256 chained over `content` cut at the end offsets `segments`, continuing from `digest`."""
+    start = 0
+    for end in segments:
+        digest = hashlib.sha256(digest.encode() + content[start:end]).hexdigest()
+        start = end
+    return digest
+
+
+def _response_meta(url, resp, length):
+    return {'url': url,
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'length': length,
+            'refreshed': datetime.datetime.now().isoformat(timespec = 'seconds')}
+
+
+def refresh(url = NYT_COUNTIES_URL, snapshot_dir = SNAPSHOT_DIR, session = None):
+    """Bring the local snapshot up to date, returns the number of rows written."""
+    import requests
+
+    session = session or requests.Session()
+    os.makedirs(snapshot_dir, exist_ok = True)
+    meta = _read_meta(snapshot_dir)
+
+    if meta is None or meta.get('url') != url:
+        return _full_refresh(url, snapshot_dir, session)
+
+    last_full = datetime.datetime.fromisoformat(meta['full_refreshed'])
+    if datetime.datetime.now() - last_full > datetime.timedelta(days = FULL_REFRESH_DAYS):
+        return _full_refresh(url, snapshot_dir, session)
+
+    tail = meta['tail']
+    offset = meta['length'] - len(tail)
+    headers = {'Range': f'bytes={offset}-',
+               # byte ranges are only meaningful against the uncompressed file
+               'Accept-Encoding': 'identity'}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    resp = session.get(url, headers = headers, timeout = 120)
+
+    if resp.status_code == 304:
+        return 0
+
+    if resp.status_code == 206:
+        body = resp.content
+        length = int(resp.headers['Content-Range'].rsplit('/', 1)[1])
+    elif resp.status_code == 200:
+        # server ignored the Range header, so we can check everything we hold, not just the tail
+        segments = meta.get('segments', [meta['length']])
+        if _chain_hash(resp.content, segments) != meta.get('sha256'):
+            return _full_refresh(url, snapshot_dir, session, resp)
+        body = resp.content[offset:]
+        length = len(resp.content)
+    else:
+        return _full_refresh(url, snapshot_dir, session)
+
+    # if the bytes we already have changed, NYT revised history and we need to rebuild
+    if not body.startswith(tail):
+        return _full_refresh(url, snapshot_dir, session)
+
+    new_bytes = body[len(tail):]
+    rows_written = 0
+    if new_bytes.strip():
+        new_rows = _parse(meta['header'].encode() + new_bytes)
+        # NYT appends whole days, but be safe about a day that straddles two refreshes
+        _write_partitions(snapshot_dir, new_rows, merge_existing = True)
+        meta['max_date'] = max(meta['max_date'], new_rows['date'].max().strftime('%Y-%m-%d'))
+        rows_written = len(new_rows)
+
+    new_meta = _response_meta(url, resp, length)
+    new_meta.update(header = meta['header'], max_date = meta['max_date'], full_refreshed = meta['full_refreshed'])
+    if resp.status_code == 200:
+        new_meta.update(sha256 = hashlib.sha256(resp.content).hexdigest(), segments = [length])
+    elif meta.get('sha256') and length > meta['length']:
+        # the appended bytes chained onto what we held, so the hash still covers all `length` of them
+        new_meta.update(sha256 = _chain_hash(new_bytes, [len(new_bytes)], meta['sha256']),
+                        segments = meta.get('segments', [meta['length']]) + [length])
+    elif meta.get('sha256'):
+        new_meta.update(sha256 = meta['sha256'], segments = meta.get('segments', [meta['length']]))
+    _write_meta(snapshot_dir, new_meta, (tail + new_bytes)[-TAIL_BYTES:])
+
+    return rows_written
+
+
+def _full_refresh(url, snapshot_dir, session, resp = None):
+    if resp is None:
+        resp = session.get(url, timeout = 600)
+    resp.raise_for_status()
+    body = resp.content
+
+    cases = _parse(body)
+    _clear_partitions(snapshot_dir)
+    _write_partitions(snapshot_dir, cases)
+
+    meta = _response_meta(url, resp, len(body))
+    meta.update(header = body[:body.index(b'\n') + 1].decode(),
+                max_date = cases['date'].max().strftime('%Y-%m-%d'),
+                full_refreshed = meta['refreshed'],
+                sha256 = hashlib.sha256(body).hexdigest(),
+                segments = [len(body)])
+    _write_meta(snapshot_dir, meta, body[-TAIL_BYTES:])
+
+    return len(cases)
+
+
+def snapshot_version(snapshot_dir = SNAPSHOT_DIR):
+    """Identifies the snapshot's contents, changes whenever a refresh writes anything."""
+    meta = _read_meta(snapshot_dir) or {}
+    return '|'.join(str(meta.get(field)) for field in ['url', 'length', 'etag', 'last_modified', 'max_date', 'sha256'])
+
+
+def load_cases(url = NYT_COUNTIES_URL, snapshot_dir = SNAPSHOT_DIR, update = True, start = None, columns = None):
+    """Shared loader for the ETLs - refresh the snapshot, then read it back in NYT file order.
+
+    `start` skips whole date partitions before that date, `columns` limits what's read from each file.
+    Comes back with the compact dtypes in covid_etl/schema.py (categorical county/state, int32 cases).
+    """
+    if update:
+        refresh(url, snapshot_dir)
+
+    files = sorted(name for name in os.listdir(snapshot_dir) if name.endswith('.parquet'))
+    if start is not None:
+        first = pd.Timestamp(start).strftime('%Y-%m-%d') + '.parquet'
+        files = [name for name in files if name >= first]
+
+    # file names sort by date, and rows within a date keep the order NYT wrote them in
+    import pyarrow.dataset as ds
+
+    snapshot = ds.dataset([os.path.join(snapshot_dir, name) for name in files], format = 'parquet')
+    return schema.compact_cases(snapshot.to_table(columns = columns).to_pandas())
+
+
+if __name__ == '__main__':
+    print('Refreshing NYT snapshot...')
+    rows = refresh()
+    print(f'{rows} rows written to {SNAPSHOT_DIR}')
@@ -0,0 +1,94 @@
+# Per-state parallel execution of the per-county kernels.
+#
+# Everything the per-county stages compute (daily new, day-over-day, rolling windows) is independent
+# per county, so the frame can be cut into partitions of whole states and run in a process pool.
+# Rather than pickle each partition out to its worker and the result back, the frame is written once,
+# reordered by partition, as an Arrow IPC file (in /dev/shm where there is one) that every worker
+# memory-maps and slices, and each worker hands its result back the same way.  Results are put back
+# in the input row order, so the output is the same as running the kernel on the whole frame.
+
+import concurrent.futures
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def partitions(keys, n):
+    """Partition number of each row, splitting on whole groups of `keys` and balancing the row counts."""
+    codes, uniques = pd.factorize(keys)
+    counts = np.bincount(codes[codes >= 0], minlength = len(uniques))
+
+    # biggest groups first, each onto the partition with the fewest rows so far
+    assignment = np.empty(len(uniques), dtype = np.int64)
+    load = np.zeros(n, dtype = np.int64)
+    for group in np.argsort(-counts, kind = 'stable'):
+        assignment[group] = load.argmin()
+        load[assignment[group]] += counts[group]
+
+    # rows with a missing key are groups of their own to the kernels, they can go anywhere
+    return np.where(codes >= 0, assignment[np.maximum(codes, 0)], 0)
+
+
+def _write(df, path):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index = True)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read(path, offset = 0, length = None):
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.slice(offset, length).to_pandas()
+
+
+def _run_partition(path, offset, length, func, kwargs, out_path):
+    result = func(_read(path, offset, length), **kwargs)
+    _write(result, out_path)
+    return out_path
+
+
+def map_partitions(df, func, partition_by = 'state', workers = None, **kwargs):
+    """`func(df, **kwargs)` run on partitions of whole `partition_by` groups in a process pool.
+
+    `func` has to return one row per input row (like the kernels in covid_etl/kernels.py) and be
+    picklable, i.e. a module-level function.  The result is in the same row order as `df`.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(df) == 0:
+        return func(df.copy(), **kwargs)
+
+    part = partitions(df[partition_by], workers)
+    order = np.argsort(part, kind = 'stable')
+    bounds = np.searchsorted(part[order], np.arange(workers + 1))
+
+    tmp_dir = tempfile.mkdtemp(prefix = 'covid_etl_', dir = SHM_DIR)
+    try:
+        path = os.path.join(tmp_dir, 'input.arrow')
+        _write(df.take(order), path)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+            futures = [pool.submit(_run_partition, path, bounds[i], bounds[i + 1] - bounds[i], func, kwargs,
+                                   os.path.join(tmp_dir, f'part-{i}.arrow'))
+                       for i in range(workers) if bounds[i + 1] > bounds[i]]
+            # in partition order whatever order they finish in, so the output is deterministic
+            results = [_read(future.result()) for future in futures]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+
+    result = pd.concat(results)
+    if len(result) != len(df):
+        raise ValueError(f'{getattr(func, "__name__", func)} returned {len(result)} rows for {len(df)}')
+
+    # back to the input order
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    return result.take(inverse)
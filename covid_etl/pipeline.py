@@ -0,0 +1,127 @@
+# A small DAG of named, memoized stages.
+#
+# Each stage is a function of the outputs of the stages it declares as inputs, plus keyword params.
+# Its cache key is a hash of the stage name, its params, the keys of its inputs and the source of the
+# covid_etl package, so a key only changes when something that feeds the stage changes.  Source
+# stages (no inputs) instead provide a `fingerprint` function that identifies the data they'd load,
+# e.g. the NYT snapshot metadata.  Outputs are pickled under CACHE_DIR by key: a stage whose key is
+# already on disk is loaded without running it or anything upstream of it, so the capacity chart and
+# the case load chart share everything up to the point their params diverge, and changing, say, the
+# bed assumptions only reruns the stage that uses them.
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+
+from covid_etl import instrument
+
+CACHE_DIR = os.environ.get('COVID_ETL_PIPELINE_DIR',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'pipeline'))
+
+# cached outputs kept per stage, older ones are removed as new ones are written
+KEEP = 3
+
+_code_version = None
+
+
+def code_version():
+    """Hash of the covid_etl sources, so editing any stage or kernel invalidates the cache."""
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+class Stage:
+
+    def __init__(self, name, func, inputs = (), params = None, fingerprint = None, memoize = True):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.fingerprint = fingerprint
+        self.memoize = memoize
+
+
+class Pipeline:
+
+    def __init__(self, cache_dir = CACHE_DIR, keep = KEEP):
+        self.cache_dir = cache_dir
+        self.keep = keep
+        self.stages = {}
+        self._keys = {}
+        self._results = {}
+
+    def add(self, name, func, inputs = (), fingerprint = None, memoize = True, **params):
+        if not inputs and fingerprint is None and memoize:
+            raise ValueError(f'source stage {name!r} needs a fingerprint to be memoized')
+        for input_name in inputs:
+            if input_name not in self.stages:
+                raise KeyError(f'stage {name!r} depends on unknown stage {input_name!r}')
+        self.stages[name] = Stage(name, func, inputs, params, fingerprint, memoize)
+        return self
+
+    def key(self, name):
+        if name not in self._keys:
+            stage = self.stages[name]
+            digest = hashlib.sha256()
+            digest.update(name.encode())
+            digest.update(code_version().encode())
+            digest.update(json.dumps(stage.params, sort_keys = True, default = repr).encode())
+            for input_name in stage.inputs:
+                digest.update(self.key(input_name).encode())
+            if stage.fingerprint is not None:
+                # for the sources this is where downloads and revalidation happen, worth timing on its own
+                with instrument.timed(f'{name}.fingerprint'):
+                    digest.update(str(stage.fingerprint()).encode())
+            elif not stage.inputs:
+                # nothing to identify the data by, unique per run so it never matches
+                digest.update(os.urandom(16))
+            self._keys[name] = digest.hexdigest()[:24]
+        return self._keys[name]
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, f'{name}-{self.key(name)}.pkl')
+
+    def _save(self, name, value):
+        os.makedirs(self.cache_dir, exist_ok = True)
+        path = self._path(name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(value, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+        # keep the most recent few per stage, the rest are from older data or code
+        older = sorted(glob.glob(os.path.join(self.cache_dir, f'{name}-*.pkl')), key = os.path.getmtime)
+        for stale in older[:-self.keep]:
+            os.remove(stale)
+
+    def get(self, name):
+        """Output of stage `name`, from memory, from the disk cache, or by running it (and what it needs)."""
+        if name in self._results:
+            return self._results[name]
+
+        stage = self.stages[name]
+        path = self._path(name)
+
+        if stage.memoize and os.path.exists(path):
+            with instrument.timed(name, source = 'cache') as record, open(path, 'rb') as f:
+                value = record['output'] = pickle.load(f)
+        else:
+            inputs = [self.get(input_name) for input_name in stage.inputs]
+            with instrument.timed(name, inputs, source = 'run') as record:
+                value = record['output'] = stage.func(*inputs, **stage.params)
+            if stage.memoize:
+                self._save(name, value)
+
+        self._results[name] = value
+        return value
+
+    def run(self, *names):
+        values = [self.get(name) for name in names]
+        return values[0] if len(values) == 1 else tuple(values)
@@ -0,0 +1,143 @@
+# Data-quality checks on the county histories, the pipeline's `quality` stage.
+#
+# NYT counts are cumulative, and a county's count sometimes goes down (a revision), or a backlog of
+# cases lands on one day (a reporting dump).  Either one skews the week-over-week change of the two
+# weeks it falls in, as does a previous week with next to no cases to divide by.  Instead of the charts
+# dropping any county with more than a 3x change, every row gets a `quality_flags` bitmask of the
+# problems in the 14 days its wkly_diff is computed from, and the charts leave out rows with any flag
+# set.  The day-over-day deltas (every <column>_delta next to a <column>_shifted, see
+# kernels.add_day_over_day) that divide by a zero day come out as NaN instead of inf.
+#
+# All of it is a few cumulative sums over the frame in county order (see covid_etl/kernels.py), and
+# report() summarizes the checks for the run as a JSON-friendly dict.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import kernels
+
+QUALITY_REPORT = os.environ.get('COVID_ETL_QUALITY_REPORT',
+                                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                             'data', 'quality_report.json'))
+
+# bits of the quality_flags column
+REVISED = 1
+DUMP = 2
+LOW_BASE = 4
+
+FLAGS = {'revised': REVISED, 'dump': DUMP, 'low_base': LOW_BASE}
+
+# a drop in the cumulative count smaller than this is a routine correction, not worth hiding a county for
+REVISION_MIN_CASES = 10
+
+# a day is a dump if it has at least DUMP_MIN_CASES new cases and DUMP_FACTOR times the mean of the days
+# before it - counties that report once a week come in around 7x, and aren't flagged
+DUMP_MIN_CASES = 100
+DUMP_FACTOR = 10
+
+# fewer new cases than this the week before and the proportional change is mostly noise
+MIN_BASE_CASES = 10
+
+
+def _window_sums(groups, sorted_values, window):
+    """Sum of each row's previous `window` rows in its group (the row itself left out), and how many there were."""
+    cumulative = np.concatenate([[0], np.cumsum(sorted_values, dtype = np.float64)])
+    index = np.arange(len(sorted_values))
+    count = np.minimum(groups.position, window)
+    return cumulative[index] - cumulative[index - count], count
+
+
+def delta_columns(frame):
+    """The day-over-day delta columns of `frame`, e.g. cases_new_delta and deaths_new_delta."""
+    return [column for column in frame.columns
+            if column.endswith('_delta') and column[:-len('_delta')] + '_shifted' in frame]
+
+
+def _zero_base(frame, delta):
+    """Rows whose day-over-day `delta` divided by a 0 day, inf before check() and NaN after."""
+    column = delta[:-len('_delta')]
+    return ((frame[f'{column}_shifted'] == 0) & (frame[column] != 0)).to_numpy()
+
+
+def _problem_days(groups, new, days):
+    """REVISED and DUMP conditions for each day on its own, in group order."""
+    # the mean of the 2 weeks before each day, a county's first day has nothing to compare with
+    trailing, count = _window_sums(groups, new, 2 * days)
+    mean = np.divide(trailing, count, out = np.zeros_like(trailing), where = count > 0)
+
+    revised = new <= -REVISION_MIN_CASES
+    dump = (new >= DUMP_MIN_CASES) & (new > DUMP_FACTOR * mean) & (count > 0)
+    return revised, dump
+
+
+def check(cases_percap, column = 'cases_new', by = 'county_label', days = 7):
+    """`cases_percap` (the week_over_week stage) with a quality_flags column, and inf in every day-over-day
+    delta column (see delta_columns()) replaced by NaN.
+
+    A row's flags cover the 2 * `days` rows before it, the two weeks in its wkly_diff: REVISED if the
+    cumulative count dropped by REVISION_MIN_CASES or more on any of them, DUMP if any of them was a
+    reporting dump, and LOW_BASE if the earlier week had fewer than MIN_BASE_CASES new cases.
+    """
+    groups = kernels.Groups(cases_percap, by)
+    revised, dump = _problem_days(groups, groups.take(cases_percap[column]).astype(np.float64), days)
+
+    flags = np.zeros(len(cases_percap), dtype = np.int8)
+    flags[_window_sums(groups, revised, 2 * days)[0] > 0] |= REVISED
+    flags[_window_sums(groups, dump, 2 * days)[0] > 0] |= DUMP
+    flags = groups.put(flags)
+
+    # NaN when the county has no rows in the earlier week, which is no base at all
+    two_wks_ago = cases_percap['two_wks_ago_cases'].to_numpy(dtype = np.float64, na_value = np.nan)
+    flags[~(two_wks_ago >= MIN_BASE_CASES)] |= LOW_BASE
+
+    return cases_percap.assign(**{delta: cases_percap[delta].replace([np.inf, -np.inf], np.nan)
+                                  for delta in delta_columns(cases_percap)},
+                               quality_flags = flags)
+
+
+def _counties(frame, mask, by):
+    return frame.loc[mask, by].nunique()
+
+
+def report(cases_percap, date = None, min_pop = 0, column = 'cases_new', by = 'county_label', days = 7):
+    """Summary of the quality checks on the output of check(): how many days and counties each check caught
+    over the whole history, and which counties over `min_pop` are flagged on `date` (default the last date).
+    `zero_base_delta` counts the days each day-over-day delta column divided by 0, by column.
+    """
+    groups = kernels.Groups(cases_percap, by)
+    revised, dump = _problem_days(groups, groups.take(cases_percap[column]).astype(np.float64), days)
+    revised, dump = groups.put(revised), groups.put(dump)
+    # the days whose day-over-day delta divided by 0, NaN in the output of check()
+    zero_base = {delta: _zero_base(cases_percap, delta) for delta in delta_columns(cases_percap)}
+
+    date = pd.Timestamp(date) if date is not None else cases_percap['date'].max()
+    flags = cases_percap['quality_flags'].to_numpy()
+    on_date = ((cases_percap['date'] == date) & (cases_percap['TOT_POP'] > min_pop)).to_numpy()
+
+    return {
+        'rows': len(cases_percap),
+        'counties': int(cases_percap[by].nunique()),
+        'dates': [cases_percap['date'].min().strftime('%Y-%m-%d'), cases_percap['date'].max().strftime('%Y-%m-%d')],
+        'days': {'revised': {'days': int(revised.sum()), 'counties': int(_counties(cases_percap, revised, by))},
+                 'dump': {'days': int(dump.sum()), 'counties': int(_counties(cases_percap, dump, by))},
+                 'zero_base_delta': {delta: {'days': int(mask.sum()),
+                                             'counties': int(_counties(cases_percap, mask, by))}
+                                     for delta, mask in zero_base.items()}},
+        'date': {'date': date.strftime('%Y-%m-%d'),
+                 'counties': int(on_date.sum()),
+                 'clean': int((on_date & (flags == 0)).sum()),
+                 'flagged': {name: sorted(map(str, cases_percap.loc[on_date & ((flags & bit) > 0), by]))
+                             for name, bit in FLAGS.items()}},
+    }
+
+
+def write_report(report, path = None):
+    path = path or QUALITY_REPORT
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(report, f, indent = 2)
+    os.replace(path + '.tmp', path)
+    return path
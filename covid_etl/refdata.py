@@ -0,0 +1,170 @@
+# Cached reference data: census regions, state abbreviations and the hospital bed GeoJSON.
+#
+# These change rarely, if ever, so there's no reason to scrape and parse them on every run.  Each
+# source is kept on disk under CACHE_DIR with the ETag/Last-Modified it came with; once it's older
+# than its TTL we revalidate with a conditional GET, and a 304 just resets the clock.  The two small
+# mappings are cached already parsed, so a warm run costs a JSON load.  If the network is down we
+# fall back to whatever is cached, and for the mappings to a copy bundled in covid_etl/data.
+
+import datetime
+import json
+import os
+import re
+
+CACHE_DIR = os.environ.get('COVID_ETL_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'cache'))
+
+BUNDLED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+REGIONS_URL = 'https://simple.wikipedia.org/wiki/List_of_regions_of_the_United_States'
+STATE_ABBREV_URL = 'https://docs.omnisci.com/v3.6.1/immerse-user-guide/state-abbreviations/'
+HOSPITALS_URL = 'https://opendata.arcgis.com/datasets/6ac5e325468c4cb9b905f1728d6fbf0f_0.geojson'
+
+STATIC_TTL = datetime.timedelta(days = 30)
+HOSPITALS_TTL = datetime.timedelta(days = 1)
+
+
+def _meta_path(path):
+    return path + '.meta.json'
+
+
+def _read_meta(path):
+    try:
+        with open(_meta_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(path, meta):
+    with open(_meta_path(path) + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(_meta_path(path) + '.tmp', _meta_path(path))
+
+
+def _is_fresh(meta, ttl):
+    checked = datetime.datetime.fromisoformat(meta['checked'])
+    return datetime.datetime.now() - checked < ttl
+
+
+def fetch(url, name, ttl, parse = None, cache_dir = None, session = None):
+    """Path to the cached copy of `url`, revalidated with the server once it's older than `ttl`.
+
+    With `parse`, what's cached is `parse(response bytes)` as JSON instead of the raw response.
+    Returns the stale copy if the server can't be reached, and raises if there's nothing cached.
+    """
+    import requests
+
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok = True)
+    path = os.path.join(cache_dir, name)
+    meta = _read_meta(path) if os.path.exists(path) else None
+
+    if meta is not None and meta.get('url') == url and _is_fresh(meta, ttl):
+        return path
+
+    headers = {}
+    if meta is not None and meta.get('url') == url:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        resp = (session or requests).get(url, headers = headers, timeout = 120, stream = True)
+        resp.raise_for_status()
+    except requests.RequestException:
+        if meta is None:
+            raise
+        return path
+
+    now = datetime.datetime.now().isoformat(timespec = 'seconds')
+    if resp.status_code == 304:
+        meta['checked'] = now
+        _write_meta(path, meta)
+        return path
+
+    with open(path + '.tmp', 'wb') as f:
+        if parse is None:
+            # streamed straight to disk, the hospital GeoJSON never has to fit in memory
+            for chunk in resp.iter_content(chunk_size = 1 << 20):
+                f.write(chunk)
+        else:
+            f.write(json.dumps(parse(resp.content), indent = 2).encode())
+    os.replace(path + '.tmp', path)
+
+    _write_meta(path, {'url': url,
+                       'etag': resp.headers.get('ETag'),
+                       'last_modified': resp.headers.get('Last-Modified'),
+                       'checked': now})
+    return path
+
+
+def _mapping(name, url, parse, ttl, cache_dir):
+    try:
+        path = fetch(url, name, ttl, parse = parse, cache_dir = cache_dir)
+    except Exception:
+        # no network and nothing cached yet, or the page changed and no longer parses
+        path = os.path.join(cache_dir or CACHE_DIR, name)
+        if not os.path.exists(path):
+            path = os.path.join(BUNDLED_DIR, name)
+    with open(path) as f:
+        return json.load(f)
+
+
+def _parse_regions(content):
+    from bs4 import BeautifulSoup
+
+    regions_soup = BeautifulSoup(content, features = 'html.parser')
+
+    def is_division(tag):
+        return tag.name == 'li' and re.search('Division', tag.contents[0])
+
+    regions_list = regions_soup.find('ul')
+    regions = regions_list.find_all('li')
+    regions_dict = dict()
+    for region in regions:
+        for division in region.find_all(is_division):
+            div_name = re.sub(r'([/w]*)(\s\(not yet started\))', r'\1', division.a['title'])
+            states = [item.string for item in division.find('ul').find_all('li')]
+            regions_dict[div_name] = states
+
+    # reshape into a state:region dictionary
+    regions_dict_inverted = {}
+    for k, v in regions_dict.items():
+        for state in v:
+            regions_dict_inverted[state] = k
+
+    return regions_dict_inverted
+
+
+def _parse_state_abbreviations(content):
+    from bs4 import BeautifulSoup
+
+    state_abbrev_soup = BeautifulSoup(content, features = 'html.parser')
+    state_abbrev = state_abbrev_soup.find('tbody')
+
+    state_abbrev_dict = {}
+
+    for row in state_abbrev.find_all('tr'):
+        cols = row.find_all('td')
+        full = cols[0].string
+        abbrev = cols[1].string
+        state_abbrev_dict[abbrev] = full
+
+    return state_abbrev_dict
+
+
+def regions(ttl = STATIC_TTL, cache_dir = None):
+    """State name -> census division, e.g. 'Washington' -> 'Pacific'."""
+    return _mapping('regions.json', REGIONS_URL, _parse_regions, ttl, cache_dir)
+
+
+def state_abbreviations(ttl = STATIC_TTL, cache_dir = None):
+    """Postal abbreviation -> state name, e.g. 'WA' -> 'Washington'."""
+    return _mapping('state_abbreviations.json', STATE_ABBREV_URL, _parse_state_abbreviations, ttl, cache_dir)
+
+
+def hospitals_path(ttl = HOSPITALS_TTL, cache_dir = None):
+    """Local path to the ArcGIS hospitals GeoJSON."""
+    return fetch(HOSPITALS_URL, 'hospitals.geojson', ttl, cache_dir = cache_dir)
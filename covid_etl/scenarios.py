@@ -0,0 +1,84 @@
+# What-if runs of the hospital capacity estimate, many sets of assumptions at once.
+#
+# The capacity stage estimates each county's free bed percentage as
+#
+#   (beds * available_beds - new cases over the last `los_days` days * hospitalization_rate) / (beds * available_beds)
+#
+# for one hospitalization rate, available-bed fraction and length of stay.  Here those are arrays, one
+# entry per scenario: each distinct length of stay is summed once over the county histories, and the
+# county x scenario matrix is a single broadcast of the formula above, rather than a rerun per scenario.
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import kernels
+
+
+def join_beds(cases_percap_recent, county_beds):
+    """Hospital beds for each county row, NaN where the hospital data has none."""
+    return cases_percap_recent.merge(county_beds,
+                                     how = 'left',
+                                     left_on = ['county_key', 'state'],
+                                     right_on = ['county_key', 'state_full']
+                                    )
+
+
+def free_bed_perc(beds, load, hospitalization_rate, available_beds):
+    """Estimated share of the beds available for covid patients that are free, broadcast over the arguments."""
+    available = beds * available_beds
+    return (available - load * hospitalization_rate) / available
+
+
+def grid(hospitalization_rate, available_beds, los_days):
+    """Every combination of the given values, as three equal-length arrays for capacity_scenarios()."""
+    mesh = np.meshgrid(hospitalization_rate, available_beds, los_days, indexing = 'ij')
+    return tuple(values.ravel() for values in mesh)
+
+
+def los_sums(cases_percap, los_days, column = 'cases_new', by = 'county_label'):
+    """`column` summed over the last n days for each distinct n in `los_days`, named like the rolling stage's
+    `<column>_sum<n>` columns.  Sums the frame already has are reused, the rest come from one rolling pass.
+    """
+    names = {days: f'{column}_sum{days}' for days in sorted(set(int(days) for days in los_days))}
+    have = [name for name in names.values() if name in cases_percap]
+    frame = cases_percap[[by, column] + have].copy()
+
+    missing = [(name, column, days, 'sum') for days, name in names.items() if name not in have]
+    if missing:
+        kernels.add_rolling(frame, missing, by = by)
+    return frame[list(names.values())]
+
+
+def capacity_scenarios(cases_percap, county_beds, hospitalization_rate, available_beds, los_days,
+                       days_back = 3, min_pop = 100000, column = 'cases_new'):
+    """Free bed percentage for every county on the snapshot date under every scenario.
+
+    `cases_percap` is the full county history (e.g. the week_over_week stage) and the three assumptions
+    are arrays with one entry per scenario, broadcast against each other (see grid() to sweep every
+    combination).  Returns a frame with a row per county, indexed by county_label, and a column per
+    scenario, labelled (hospitalization_rate, available_beds, los_days).
+    """
+    rate, available, los = np.broadcast_arrays(np.asarray(hospitalization_rate, dtype = np.float64),
+                                               np.asarray(available_beds, dtype = np.float64),
+                                               np.asarray(los_days, dtype = np.int64))
+    rate, available, los = rate.ravel(), available.ravel(), los.ravel()
+    windows, los_index = np.unique(los, return_inverse = True)
+
+    # the same counties and date as the snapshot stage, but the windows need the whole history
+    snapshot_date = cases_percap['date'].max() - datetime.timedelta(days = days_back)
+    rows = ((cases_percap['TOT_POP'] > min_pop) & (cases_percap['date'] == snapshot_date)).to_numpy()
+    loads = los_sums(cases_percap, windows, column).to_numpy(dtype = np.float64)[rows]
+
+    counties = join_beds(cases_percap.loc[rows, ['county_label', 'county_key', 'state']], county_beds)
+    beds = counties['BEDS'].to_numpy(dtype = np.float64, na_value = np.nan)
+
+    # counties x scenarios, the load for each scenario's length of stay picked out by column
+    result = free_bed_perc(beds[:, None], loads[:, los_index], rate[None, :], available[None, :])
+
+    return pd.DataFrame(result,
+                        index = pd.Index(counties['county_label'], name = 'county_label'),
+                        columns = pd.MultiIndex.from_arrays([rate, available, los],
+                                                            names = ['hospitalization_rate', 'available_beds',
+                                                                     'los_days']))
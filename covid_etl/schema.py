@@ -0,0 +1,55 @@
+# Compact dtypes for the case frames.
+#
+# Read back as-is, the NYT history carries county and state as a Python string on every row and
+# every count as int64, and the per-capita rates and rolling stats are float64.  None of that needs
+# the width: a county's name repeats on every day of its history, counts fit in int32, and the rates
+# feed charts, not accounting.  Categoricals also make the county keys cheap to group and merge on,
+# since pandas works with their integer codes instead of hashing strings.
+
+import numpy as np
+import pandas as pd
+
+CASE_DTYPES = {'county': 'category', 'state': 'category', 'fips': 'Int32', 'cases': np.int32,
+               # deaths is blank for a few areas, float32 holds the counts exactly and keeps the NaN
+               'deaths': np.float32}
+
+# per-capita rates and rolling stats
+RATE_DTYPE = np.float32
+
+
+def compact_cases(cases):
+    """NYT case rows with CASE_DTYPES applied to whichever of its columns are present."""
+    return cases.astype({column: dtype for column, dtype in CASE_DTYPES.items() if column in cases})
+
+
+def compact_population(population):
+    """Census columns as categoricals (names) and int32 (population counts)."""
+    dtypes = {}
+    for column, dtype in population.dtypes.items():
+        if dtype.kind in 'iu':
+            dtypes[column] = np.int32
+        elif not isinstance(dtype, pd.CategoricalDtype) and dtype.kind not in 'fmMb':
+            dtypes[column] = 'category'
+    return population.astype(dtypes)
+
+
+def county_labels(county, state):
+    """'County, State' labels as a categorical, building each label string once per county instead of once per row.
+
+    Categories are sorted, so sorting on the labels orders rows the same as sorting the strings would.
+    """
+    county_codes, counties = pd.factorize(county)
+    state_codes, states = pd.factorize(state)
+
+    # one code per (county, state) pair, a missing county or state gives a missing label like concatenating NaN would
+    pairs = county_codes.astype(np.float64) * len(states) + state_codes
+    pairs[(county_codes < 0) | (state_codes < 0)] = np.nan
+    pair_codes, pairs = pd.factorize(pairs)
+    pairs = pairs.astype(np.int64)
+
+    labels = (np.asarray(counties, dtype = object)[pairs // len(states)] + ', ' +
+              np.asarray(states, dtype = object)[pairs % len(states)])
+    label_codes, categories = pd.factorize(labels, sort = True)
+
+    codes = np.where(pair_codes >= 0, label_codes[pair_codes], -1) if len(pairs) else pair_codes
+    return pd.Series(pd.Categorical.from_codes(codes, categories = categories), index = county.index, name = 'county_label')
@@ -0,0 +1,238 @@
+# Small asyncio HTTP server for the chart data, straight out of the county_daily_metrics table.
+#
+#   GET /snapshot?date=2020-04-20&min_pop=100000&chart=capacity_vs_case_delta   counties on one date
+#                                                                                (default the snapshot date)
+#   GET /county/53033?start=2020-03-01&end=2020-04-30                            one county's history
+#   GET /charts/case_load_vs_case_delta?date=2020-04-20                          Vega-Lite spec, data by URL
+#
+# Responses are JSON, cached in memory in an LRU keyed by the endpoint, its parameters and the
+# metrics DB's modification time (so a nightly rewrite invalidates everything), with an ETag for
+# conditional requests and gzip for clients that accept it.  Queries run in the default executor so
+# a slow one doesn't hold up the event loop.  Run with `python -m covid_etl.server --port 8000`.
+
+import argparse
+import asyncio
+import collections
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import urllib.parse
+
+from covid_etl import metrics
+
+CACHE_SIZE = 256
+
+# not worth compressing below this
+GZIP_MIN_BYTES = 1024
+
+REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+
+class LRUCache:
+
+    def __init__(self, size = CACHE_SIZE):
+        self.size = size
+        self._items = collections.OrderedDict()
+
+    def get(self, key):
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last = False)
+
+
+class Body:
+    """A JSON response body with its ETag, gzipped once up front if it's big enough to be worth it."""
+
+    def __init__(self, content):
+        self.content = content
+        self.etag = '"' + hashlib.sha1(content).hexdigest()[:20] + '"'
+        self.gzipped = gzip.compress(content, compresslevel = 6) if len(content) >= GZIP_MIN_BYTES else None
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _date(value):
+    return datetime.date.fromisoformat(value).isoformat()
+
+
+def _records(frame):
+    return frame.to_json(orient = 'records', date_format = 'iso', double_precision = 6).encode()
+
+
+def _param(params, name, default = None, parse = str):
+    if name not in params:
+        return default
+    try:
+        return parse(params[name])
+    except ValueError:
+        raise HTTPError(400, f'bad value for {name}: {params[name]!r}')
+
+
+class ChartDataServer:
+
+    def __init__(self, db = None, cache_size = CACHE_SIZE):
+        self.db = db or metrics.METRICS_DB
+        self.cache = LRUCache(cache_size)
+
+    def version(self):
+        try:
+            stat = os.stat(self.db)
+        except OSError:
+            raise HTTPError(500, 'no metrics database, run the capacity ETL first')
+        return stat.st_mtime_ns
+
+    def snapshot(self, params):
+        chart = _param(params, 'chart')
+        frame = metrics.get_snapshot(_param(params, 'date', parse = _date), _param(params, 'min_pop', 100000, int),
+                                     db = self.db)
+        if chart is not None:
+            from covid_etl import charts
+
+            if chart not in charts.CHART_FILTERS:
+                raise HTTPError(404, f'no chart {chart!r}')
+            frame = charts.chart_data(chart, frame)
+        return _records(frame)
+
+    def county(self, params, fips):
+        try:
+            fips = int(fips)
+        except ValueError:
+            raise HTTPError(404, f'no county {fips!r}')
+        frame = metrics.get_county_series(fips, _param(params, 'start', parse = _date),
+                                          _param(params, 'end', parse = _date), db = self.db)
+        if frame.empty:
+            raise HTTPError(404, f'no county {fips}')
+        return _records(frame)
+
+    def chart(self, params, name):
+        # altair is only needed for this endpoint
+        from covid_etl import charts
+
+        if name not in charts.CHARTS:
+            raise HTTPError(404, f'no chart {name!r}')
+        # the data URLs name the date, the pipeline's snapshot date unless asked for another, so the spec
+        # shows the same numbers as the published page and doesn't change meaning when the table is rewritten
+        query = {'date': _param(params, 'date', parse = _date) or metrics.get_snapshot_date(self.db),
+                 **{key: params[key] for key in ('min_pop',) if key in params}}
+        data = '/snapshot?' + urllib.parse.urlencode(sorted({'chart': name, **query}.items()))
+        if name == 'case_load_vs_case_delta':
+            # the marked counties come from the unfiltered snapshot, like charts.annotations()
+            chart = charts.case_load_vs_case_delta(data, '/snapshot?' + urllib.parse.urlencode(sorted(query.items())))
+        else:
+            chart = charts.CHARTS[name](data)
+        spec = chart.to_dict()
+        return json.dumps(spec).encode()
+
+    def route(self, path):
+        parts = [part for part in path.split('/') if part]
+        if parts == ['snapshot']:
+            return self.snapshot, ()
+        if len(parts) == 2 and parts[0] == 'county':
+            return self.county, (parts[1],)
+        if len(parts) == 2 and parts[0] == 'charts':
+            return self.chart, (parts[1],)
+        raise HTTPError(404, f'no such endpoint {path}')
+
+    async def body(self, target):
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        handler, args = self.route(url.path)
+
+        key = (url.path, tuple(sorted(params.items())), self.version())
+        body = self.cache.get(key)
+        if body is None:
+            content = await asyncio.get_running_loop().run_in_executor(None, handler, params, *args)
+            body = Body(content)
+            self.cache.put(key, body)
+        return body
+
+    async def respond(self, method, target, headers):
+        """Status, response headers and content for one request."""
+        if method not in ('GET', 'HEAD'):
+            raise HTTPError(405, f'{method} not allowed')
+
+        body = await self.body(target)
+        response_headers = {'Content-Type': 'application/json', 'ETag': body.etag,
+                            'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+
+        if body.etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            return 304, response_headers, b''
+
+        content = body.content
+        if body.gzipped is not None and 'gzip' in headers.get('accept-encoding', ''):
+            content = body.gzipped
+            response_headers['Content-Encoding'] = 'gzip'
+        return 200, response_headers, content
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split(maxsplit = 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    status, response_headers, content = await self.respond(method, target, headers)
+                except HTTPError as e:
+                    status, response_headers = e.status, {'Content-Type': 'application/json'}
+                    content = json.dumps({'error': str(e)}).encode()
+                except Exception as e:
+                    status, response_headers = 500, {'Content-Type': 'application/json'}
+                    content = json.dumps({'error': f'{type(e).__name__}: {e}'}).encode()
+
+                keep_alive = (version.strip() == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close')
+                response_headers['Content-Length'] = str(len(content))
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+
+                writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'.encode() +
+                             ''.join(f'{name}: {value}\r\n' for name, value in response_headers.items()).encode() +
+                             b'\r\n' + (content if method != 'HEAD' else b''))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            # client went away or sent something that isn't HTTP
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host = '127.0.0.1', port = 8000, db = None):
+    server = ChartDataServer(db)
+    async with await asyncio.start_server(server.handle, host, port) as listener:
+        print(f'Serving chart data from {server.db} on http://{host}:{port}/')
+        await listener.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Serve chart data from the county metrics database.')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8000)
+    parser.add_argument('--db', default = None, help = f'metrics database (default {metrics.METRICS_DB})')
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, args.db))
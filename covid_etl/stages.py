@@ -0,0 +1,226 @@
+# The county pipeline: load -> daily new -> census join / per-capita -> day-over-day -> rolling ->
+# week-over-week -> quality flags -> snapshot -> hospital capacity, as stages of a covid_etl.pipeline.Pipeline.
+#
+# Stage functions take their inputs as frames and must not modify them, the same output can feed
+# several downstream stages (and come straight out of the in-memory cache).
+
+import datetime
+import functools
+import json
+import os
+import sqlite3
+
+from covid_etl import census, fips, hospitals, kernels, lazy, nyt, parallel, quality, refdata, scenarios, schema
+from covid_etl.pipeline import Pipeline
+
+# the NYT columns carried through the census join, everything the ETLs use before their own rolling windows
+PERCAP_COLUMNS = ['county', 'state', 'fips', 'date', 'cases', 'deaths', 'cases_shifted', 'cases_new', 'deaths_new',
+                  'pop_fips']
+
+# estimate of free bed percentage assuming 20% hospitalization rate and 39% of beds available for covid patients,
+# and a 12-day average length of stay (the 12-day rolling sum of new cases)
+HOSPITALIZATION_RATE = 0.2
+AVAILABLE_BEDS = 0.39
+LOS_COLUMN = 'cases_new_sum12'
+
+# where the quality stage, and so the quality report and the snapshot, come from: 'pandas' runs every stage
+# over the whole history, 'duckdb' reads just the trailing days the snapshot depends on (see covid_etl/lazy.py)
+# and has no full-history stages at all, so no daily_metrics either
+BACKENDS = ['pandas', 'duckdb']
+
+
+def nyt_snapshot():
+    return nyt.SNAPSHOT_DIR
+
+
+def load_cases(snapshot_dir):
+    return nyt.load_cases(snapshot_dir = snapshot_dir, update = False)
+
+
+def refresh_cases():
+    # the fingerprint of the load stage, so a refresh that writes nothing keeps every key the same
+    nyt.refresh()
+    return nyt.snapshot_version()
+
+
+def census_version(census_db):
+    # the path too, a copy or another vintage can have the same size and mtime
+    stat = os.stat(census_db)
+    return f'{os.path.realpath(census_db)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def load_census(census_db):
+    # 2017 county census estimate from US Census Bureau.  Written locally to SQLite database
+    # to avoid having to re-download every time, see publish/census_etl.py for details
+    conn = sqlite3.connect(census_db)
+    try:
+        # FIPS crosswalk and 2017 population per join county - the five NYC boroughs are rolled up into one
+        # area and cities like St. Louis and Baltimore join to the surrounding county, see covid_etl/fips.py
+        crosswalk = census.load_crosswalk(conn)
+        pop17 = schema.compact_population(census.load_population(conn, crosswalk, columns = ['region']))
+    finally:
+        conn.close()
+    return {'crosswalk': crosswalk, 'population': pop17}
+
+
+def daily_new(cases, workers = None):
+    # Cases are cumulative, we want new cases and deaths each day to estimate the hospital case load.
+    # With `workers`, states are split across a process pool (see covid_etl/parallel.py)
+    if workers:
+        return parallel.map_partitions(cases, kernels.add_daily_new, partition_by = 'state', workers = workers,
+                                       metrics = ['cases', 'deaths'], by = ['county', 'state'])
+    return kernels.add_daily_new(cases.copy(), ['cases', 'deaths'], by = ['county', 'state'])
+
+
+def percap(daily, census_tables):
+    # join cases and census on the crosswalked FIPS code
+    cases = fips.assign_pop_fips(daily[['county', 'state', 'fips']].copy(), census_tables['crosswalk'])
+    # NYT has no fips for New York City, it takes the rollup code so every county has one
+    cases_percap = fips.join_population(daily.assign(pop_fips = cases['pop_fips'],
+                                                     fips = cases['fips'].fillna(cases['pop_fips']))[PERCAP_COLUMNS],
+                                        census_tables['population'])
+
+    # NYT leaves deaths blank for a few areas, count those as 0 rather than dropping the rows below
+    cases_percap = cases_percap.fillna({'deaths': 0, 'deaths_new': 0})
+
+    # calculate per-capita rates, float32 is plenty for a chart (see covid_etl/schema.py)
+    # and the categorical county_label builds each label once per county rather than once per row
+    cases_percap = (cases_percap
+                    .dropna()
+                    .assign(cases_per1k = lambda x: (x.cases / x.TOT_POP * 1000).astype(schema.RATE_DTYPE),
+                            cases_new_per1k = lambda x: (x.cases_new / x.TOT_POP * 1000).astype(schema.RATE_DTYPE),
+                            deaths_per1k = lambda x: (x.deaths / x.TOT_POP * 1000).astype(schema.RATE_DTYPE),
+                            deaths_new_per1k = lambda x: (x.deaths_new / x.TOT_POP * 1000).astype(schema.RATE_DTYPE),
+                            county_label = lambda x: schema.county_labels(x.county, x.STNAME))
+                    .sort_values(['county_label', 'date'])
+                   )
+
+    # shift new cases and deaths to get day-over-day change
+    return kernels.add_day_over_day(cases_percap, ['cases_new', 'deaths_new'], by = ['county', 'state'])
+
+
+def rolling(cases_percap, specs, workers = None):
+    # rolling windows per county, all computed in one cumulative-sum pass per column (see covid_etl/kernels.py)
+    specs = [tuple(spec) for spec in specs]
+    if workers:
+        return parallel.map_partitions(cases_percap, kernels.add_rolling, partition_by = 'state', workers = workers,
+                                       specs = specs, by = 'county_label')
+    return kernels.add_rolling(cases_percap.copy(), specs, by = 'county_label')
+
+
+def week_over_week(cases_percap):
+    # week-over-week proportional change in new cases for every county and date (see covid_etl/kernels.py),
+    # comparing the 7 days before each date with the 7 before that
+    return kernels.add_week_over_week(cases_percap.copy(), 'cases_new', by = 'county_label')
+
+
+def quality_flags(cases_percap):
+    # flag the rows whose week-over-week change is thrown off by a revision, a reporting dump or a tiny
+    # previous week, for the charts to leave out (see covid_etl/quality.py)
+    return quality.check(cases_percap, 'cases_new', by = 'county_label')
+
+
+def quality_report(cases_percap, days_back, min_pop):
+    # what the checks caught, and which of the snapshot counties the charts leave out because of it
+    snapshot_date = cases_percap.date.max() - datetime.timedelta(days = days_back)
+    return quality.report(cases_percap, snapshot_date, min_pop)
+
+
+def snapshot(cases_percap, days_back, min_pop):
+    # filter for days_back days ago, giving some time for the latest data to be populated
+    snapshot_date = cases_percap.date.max() - datetime.timedelta(days = days_back)
+
+    return cases_percap.query('TOT_POP > @min_pop and date == @snapshot_date').reset_index(drop = True)
+
+
+def trailing_quality(snapshot_dir, census_tables, specs, days_back):
+    # the quality stage for only the days the snapshot looks back over, through the same stage functions
+    cases = lazy.load_trailing(snapshot_dir, days_back + lazy.lookback_days(specs))
+    return quality_flags(week_over_week(rolling(percap(daily_new(cases), census_tables), specs)))
+
+
+def hospitals_version():
+    # what the server said about the file, not when it was last asked - a 304 keeps every key the same
+    path = refdata.hospitals_path()
+    with open(path + '.meta.json') as f:
+        meta = json.load(f)
+    version = {key: meta.get(key) for key in ('url', 'etag', 'last_modified')}
+    if not (version['etag'] or version['last_modified']):
+        # a server with neither header is downloaded again on every revalidation, the file says if it changed
+        stat = os.stat(path)
+        version['file'] = f'{stat.st_size}|{stat.st_mtime_ns}'
+    return json.dumps(version, sort_keys = True)
+
+
+def county_beds():
+    # get total acute/ICU beds per county, streamed from the cached hospital GeoJSON (see covid_etl/hospitals.py)
+    county_beds = (hospitals.county_beds(hospitals.file_chunks(refdata.hospitals_path()))
+                   .assign(county_key = lambda x: x['COUNTY'].str.lower())
+                  )
+
+    # map state abbreviations to full name to join to case data
+    county_beds['state_full'] = county_beds['STATE'].map(refdata.state_abbreviations())
+
+    # have to also do the NYC correction
+    ny_idx = county_beds['county_key'].str.contains('new york|kings|queens|bronx|richmond') & \
+        county_beds['state_full'].eq('New York')
+
+    county_beds.loc[ny_idx, 'county_key'] = 'new york city'
+
+    return (county_beds
+            .groupby(['county_key', 'state_full', 'STATE'])
+            .aggregate({'BEDS': 'sum'})
+            .reset_index()
+           )
+
+
+def capacity(cases_percap_recent, county_beds, hospitalization_rate, available_beds, los_column):
+    # join back to cases
+    cases_percap_recent = scenarios.join_beds(cases_percap_recent, county_beds)
+
+    # one scenario of covid_etl/scenarios.py, which sweeps these assumptions over arrays of values
+    cases_percap_recent['free_bed_perc'] = scenarios.free_bed_perc(cases_percap_recent['BEDS'],
+                                                                   cases_percap_recent[los_column],
+                                                                   hospitalization_rate, available_beds)
+    return cases_percap_recent
+
+
+def county_pipeline(census_db, rolling_specs, days_back = 3, min_pop = 100000,
+                    hospitalization_rate = HOSPITALIZATION_RATE, available_beds = AVAILABLE_BEDS,
+                    los_column = LOS_COLUMN, cache_dir = None, workers = None, backend = None):
+    """The county stages, keyed so that every ETL shares the cached prefix up to its own params.
+
+    `workers` runs the per-county kernels on partitions of whole states in that many processes.  It isn't
+    part of any stage's key, the output is the same either way.  `backend` (default $COVID_ETL_BACKEND, or
+    'pandas') picks where the quality stage comes from, see BACKENDS.  With 'duckdb' the pipeline only has
+    the stages the snapshot needs: quality, quality_report, snapshot and capacity.
+    """
+    backend = backend or os.environ.get('COVID_ETL_BACKEND', 'pandas')
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown backend {backend!r}, expected one of {BACKENDS}')
+
+    pipe = Pipeline(**({'cache_dir': cache_dir} if cache_dir else {}))
+
+    # the snapshot location, keyed on its contents after a refresh
+    pipe.add('nyt_snapshot', nyt_snapshot, fingerprint = refresh_cases)
+    pipe.add('census', lambda: load_census(census_db), fingerprint = lambda: census_version(census_db))
+    if backend == 'duckdb':
+        pipe.add('quality', trailing_quality, ['nyt_snapshot', 'census'], specs = rolling_specs, days_back = days_back)
+    else:
+        pipe.add('cases', load_cases, ['nyt_snapshot'])
+        pipe.add('daily_new', functools.partial(daily_new, workers = workers), ['cases'])
+        pipe.add('percap', percap, ['daily_new', 'census'])
+        pipe.add('rolling', functools.partial(rolling, workers = workers), ['percap'], specs = rolling_specs)
+        pipe.add('week_over_week', week_over_week, ['rolling'])
+        pipe.add('quality', quality_flags, ['week_over_week'])
+    pipe.add('quality_report', quality_report, ['quality'], days_back = days_back, min_pop = min_pop)
+    pipe.add('snapshot', snapshot, ['quality'], days_back = days_back, min_pop = min_pop)
+    pipe.add('county_beds', county_beds, fingerprint = hospitals_version)
+    pipe.add('capacity', capacity, ['snapshot', 'county_beds'], hospitalization_rate = hospitalization_rate,
+             available_beds = available_beds, los_column = los_column)
+    if backend == 'pandas':
+        # the same for every date, materialized for the dashboards by covid_etl/metrics.py
+        pipe.add('daily_metrics', capacity, ['quality', 'county_beds'], hospitalization_rate = hospitalization_rate,
+                 available_beds = available_beds, los_column = los_column)
+
+    return pipe
@@ -0,0 +1,173 @@
+# Local cache of the WA DOH event-date workbook (daily new cases and deaths by county).
+#
+# The workbook is downloaded through covid_etl/refdata.py, so it's only revalidated with DOH once
+# WORKBOOK_TTL has passed and a 304 costs nothing.  The Cases and Deaths sheets are read once with
+# openpyxl in read-only mode, row by row, and kept as typed Parquet files under a directory named for
+# the workbook's dtm_updated timestamp.  A rerun with the same workbook file doesn't open it at all;
+# a new download only has its first row read, and is parsed only if dtm_updated moved on.
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from covid_etl import kernels, refdata
+
+WA_DOH_URL = os.environ.get('WA_DOH_URL',
+                            'https://www.doh.wa.gov/Portals/1/Documents/1600/coronavirus/data-tables/'
+                            'PUBLIC-CDC-Event-Date-SARS.xlsx')
+
+CACHE_DIR = os.environ.get('WA_DOH_DIR',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                        'data', 'wa_doh'))
+
+WORKBOOK_FILE = 'PUBLIC-CDC-Event-Date-SARS.xlsx'
+META_FILE = '_sheets.json'
+
+# DOH updates the workbook about once a day
+WORKBOOK_TTL = datetime.timedelta(hours = 6)
+
+# sheet -> the daily count taken from it
+SHEETS = {'Cases': 'NewPos_All', 'Deaths': 'Deaths'}
+
+DATE_COLUMNS = ['Day', 'WeekStartDate', 'dtm_updated']
+
+MA_DAYS = 5
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(cache_dir, meta):
+    path = os.path.join(cache_dir, META_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent = 2)
+    os.replace(path + '.tmp', path)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return f'{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def _sheet_rows(workbook, sheet):
+    """The header and an iterator over the rest of the rows of `sheet`, blank rows skipped."""
+    rows = workbook[sheet].iter_rows(values_only = True)
+    header = next(rows)
+    return header, (row for row in rows if any(value is not None for value in row))
+
+
+def _version(workbook, path):
+    """The workbook's dtm_updated as a directory name, or a hash of the file if it has none."""
+    header, rows = _sheet_rows(workbook, 'Cases')
+    first = next(rows, None)
+    if first is not None and 'dtm_updated' in header:
+        return pd.Timestamp(first[header.index('dtm_updated')]).strftime('%Y%m%dT%H%M%S%f')
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return 'sha1-' + digest.hexdigest()
+
+
+def _compact(frame):
+    """Categorical county names, datetime days and int32 counts where the values allow it."""
+    for column in frame:
+        values = frame[column]
+        if column in DATE_COLUMNS:
+            frame[column] = pd.to_datetime(values)
+        elif values.dtype.kind in 'if':
+            numbers = values.to_numpy(dtype = np.float64)
+            # blank cells come through as NaN, those columns stay float
+            if np.isfinite(numbers).all() and (numbers == np.round(numbers)).all() \
+                    and np.abs(numbers).max(initial = 0) <= np.iinfo(np.int32).max:
+                frame[column] = numbers.astype(np.int32)
+            else:
+                frame[column] = numbers.astype(np.float32)
+        else:
+            frame[column] = values.astype('category')
+    return frame
+
+
+def _parse_sheets(workbook):
+    sheets = {}
+    for sheet in SHEETS:
+        header, rows = _sheet_rows(workbook, sheet)
+        sheets[sheet] = _compact(pd.DataFrame.from_records(list(rows), columns = header))
+    return sheets
+
+
+def load(url = WA_DOH_URL, cache_dir = None, ttl = WORKBOOK_TTL):
+    """The Cases and Deaths sheets as {sheet: frame}, from the Parquet cache unless DOH has published an update."""
+    cache_dir = cache_dir or CACHE_DIR
+    path = refdata.fetch(url, WORKBOOK_FILE, ttl, cache_dir = cache_dir)
+
+    meta = _read_meta(cache_dir)
+    version = meta.get('version') if meta.get('workbook') == _signature(path) else None
+
+    workbook = None
+    if version is None:
+        import openpyxl
+
+        # read-only streams each sheet's XML rather than building the whole workbook in memory
+        workbook = openpyxl.load_workbook(path, read_only = True, data_only = True)
+        version = _version(workbook, path)
+
+    sheet_dir = os.path.join(cache_dir, version)
+    files = {sheet: os.path.join(sheet_dir, sheet + '.parquet') for sheet in SHEETS}
+    try:
+        if not all(os.path.exists(file) for file in files.values()):
+            if workbook is None:
+                # the cache was cleared under us, start over from the workbook
+                _write_meta(cache_dir, {})
+                return load(url, cache_dir, ttl)
+
+            os.makedirs(sheet_dir, exist_ok = True)
+            for sheet, frame in _parse_sheets(workbook).items():
+                frame.to_parquet(files[sheet] + '.tmp', index = False)
+                os.replace(files[sheet] + '.tmp', files[sheet])
+    finally:
+        if workbook is not None:
+            workbook.close()
+
+    # the previous update's sheets aren't needed once this one is on disk
+    if meta.get('version') not in (None, version):
+        shutil.rmtree(os.path.join(cache_dir, meta['version']), ignore_errors = True)
+    _write_meta(cache_dir, {'workbook': _signature(path), 'version': version})
+
+    return {sheet: pd.read_parquet(file) for sheet, file in files.items()}
+
+
+def daily(sheets, by = None, days = MA_DAYS):
+    """New cases and deaths per Day, statewide or per `by` (e.g. 'County'), with `days`-day moving averages.
+
+    The averages are `new_cases_MA` and `deaths_MA`, NaN until a full window of days is in.
+    """
+    keys = ['Day'] if by is None else [by, 'Day']
+    frame = (pd.concat([sheets[sheet].groupby(keys, observed = True)[column].sum()
+                        for sheet, column in SHEETS.items()], axis = 1)
+             .fillna(0)
+             .astype(np.int32)
+             .sort_index()
+             .reset_index()
+            )
+    kernels.add_rolling(frame, [('new_cases_MA', 'NewPos_All', days, 'mean'),
+                                ('deaths_MA', 'Deaths', days, 'mean')],
+                        by = [] if by is None else by)
+    return frame
+
+
+if __name__ == '__main__':
+    sheets = load()
+    for sheet, frame in sheets.items():
+        print(f'{sheet}: {len(frame):,} rows, {frame["Day"].min():%Y-%m-%d} to {frame["Day"].max():%Y-%m-%d}')
@@ -1,84 +1,43 @@
-# Small ETL job to pull 2017 census from the Census Bureau, build the join key, and write to a sqlite database
-
-from bs4 import BeautifulSoup
-import pandas as pd
-import requests
+# Small ETL job to pull the county population estimates from the Census Bureau, build the join key, and write to a
+# sqlite database
+#
+# The file is streamed in chunks of only the columns the ETLs use and inserted as it goes, so memory stays flat
+# however big the file (see covid_etl/census.py).  The 2017 estimates are the default, newer vintages work the same:
+#
+#   python publish/census_etl.py --vintage 2019
+#   python publish/census_etl.py --source cc-est2017-alldata.csv     # a local copy
+
+import argparse
+import os
 import sqlite3
-import re
-
-print('Fetching census data...')
-# get data
-pop = pd.read_csv('https://www2.census.gov/programs-surveys/popest/datasets/2010-2017/counties/asrh/cc-est2017-alldata.csv',
-                 encoding='ISO-8859-1')
-
-
-print('Processing...')
-
-# create join key, add description for keyed fields
-# data dictionary: https://www2.census.gov/programs-surveys/popest/technical-documentation/file-layouts/2010-2017/cc-est2017-alldata.pdf?#
-
-year_map = {1: '4/1/2010 census', 2: '4/1/2010 est. base', 3: '7/1/2010 est.', 4: '7/1/2011 est.', 5: '7/1/2012 est.',
-            6: '7/1/2013 est.', 7: '7/1/2014 est.', 8: '7/1/2015 est.', 9: '7/1/2016 est.', 10: '7/1/17 est.'}
-agegrp_map = {0: 'Total', 1: '0-4', 2: '5-9', 3: '10-14', 4: '15-19', 5: '20-24', 6: '25-29', 7: '30-34', 8: '35-38',
-              9: '40-44', 10: '45-49', 11: '50-54', 12: '55-59', 13: '60-64', 14: '65-69', 15: '70-74',
-              16: '75-79', 17: '80-84', 18: '85+'}
-
-pop = pop.assign(COUNTY_KEY = lambda x: x['CTYNAME'].str.extract(r'([A-Za-z\s\.\-\']*)(?=\sCounty|\sParish)'),
-                 YEAR_DESCR = lambda x: x['YEAR'].map(year_map),
-                 AGEGRP_DESCR = lambda x: x['AGEGRP'].map(agegrp_map)
-                )
+import sys
 
+# the shared covid_etl package lives at the repo root, one level up from publish/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Manually fix a few County/district names so they join to the NYT cases dataset
+from covid_etl import census, instrument, refdata
 
-# All cases for the five boroughs of New York City
-# (New York, Kings, Queens, Bronx and Richmond counties)
-# are assigned to a single area called New York City.
-nyc_idx = (pop.CTYNAME.str.contains(r'New York|Kings|Queens|Bronx|Richmond')) \
-    & (pop.STNAME == 'New York')
+parser = argparse.ArgumentParser(description = 'Load the county population estimates into US_county_census.db.')
+parser.add_argument('--vintage', type = int, choices = sorted(census.VINTAGES), default = census.DEFAULT_VINTAGE)
+parser.add_argument('--source', default = None, help = "the vintage's cc-est file, a path or URL (default Census Bureau)")
+parser.add_argument('--chunksize', type = int, default = census.CHUNK_ROWS)
+parser.add_argument('--db', default = 'US_county_census.db')
+args = parser.parse_args()
 
-pop.loc[nyc_idx, 'COUNTY_KEY'] = 'New York City'
+source = args.source or census.VINTAGES[args.vintage]['url']
 
-# D.C
-pop.loc[pop.CTYNAME == 'District of Columbia', 'COUNTY_KEY'] = 'District of Columbia'
-
-# make case insensitive
-pop['COUNTY_KEY'] = pop.COUNTY_KEY.str.lower()
-
-# pull in census bureau regions to add a geographic dimension
+# pull in census bureau regions to add a geographic dimension (cached, see covid_etl/refdata.py)
 print('Fetching region data...')
+regions = refdata.regions()
 
-regions_html = requests.get('https://simple.wikipedia.org/wiki/List_of_regions_of_the_United_States')
-regions_soup = BeautifulSoup(regions_html.content, features = 'html.parser')
-
-def is_division(tag):
-    return tag.name == 'li' and re.search('Division', tag.contents[0])
-
-regions_list = regions_soup.find('ul')
-regions = regions_list.find_all('li')
-regions_dict = dict()
-for region in regions:
-    for division in region.find_all(is_division):
-        div_name = re.sub(r'([/w]*)(\s\(not yet started\))', r'\1', division.a['title'])
-        states = [item.string for item in division.find('ul').find_all('li')]
-        regions_dict[div_name] = states
-
-# reshape into a state:region dictionary
-regions_dict_inverted = {}
-for k, v in regions_dict.items():
-    for state in v:
-        regions_dict_inverted[state] = k
-
-# map to dataset
-pop['region'] = pop['STNAME'].map(regions_dict_inverted)
-
-print('Writing to DB...')
+print(f'Loading {source}...')
 
-# create DB
-conn = sqlite3.connect('US_county_census.db')
+conn = sqlite3.connect(args.db)
 
-pop.to_sql(name = 'census', con = conn, if_exists = 'replace')
+# county keys (with the NYC and D.C. fixes) are cleaned once per distinct name, see covid_etl/names.py
+with instrument.timed('census.ingest'):
+    rows = census.ingest(conn, source, args.vintage, regions = regions, chunksize = args.chunksize)
 
 conn.close()
 
-print('ETL Complete.')
+print(f'ETL Complete, {rows:,} rows.')
@@ -0,0 +1,68 @@
+# Publish job: run the case load ETL and render the dashboard page, no notebook or Jupyter kernel involved.
+#
+# Replaces `jupyter nbconvert --execute case_load_vs_case_delta.ipynb`.  The ETL runs the same way the
+# notebook's `%run -i` ran it, the chart comes from covid_etl/charts.py with its data in a sidecar file
+# under chart_data/, and the page around it is template.html.  altair is only imported once there's a chart
+# to render, and requests / bs4 only if the NYT snapshot or the reference data cache needs refreshing.
+
+import argparse
+import os
+import runpy
+import string
+import sys
+import time
+
+PUBLISH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the shared covid_etl package lives at the repo root, one level up from publish/
+sys.path.insert(0, os.path.dirname(PUBLISH_DIR))
+
+TEMPLATE = os.path.join(PUBLISH_DIR, 'template.html')
+
+
+def render(cases_percap_recent, output, template = TEMPLATE):
+    """Write the dashboard page for the snapshot `cases_percap_recent` to `output`, chart data under chart_data/."""
+    from covid_etl import charts
+
+    chart = charts.case_load_vs_case_delta(charts.chart_data('case_load_vs_case_delta', cases_percap_recent),
+                                           charts.annotations(cases_percap_recent))
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(output)), charts.DATA_DIR)
+
+    with open(template) as f:
+        page = string.Template(f.read()).substitute(
+            chart = charts.embed(chart, data_dir, charts.DATA_DIR + '/', page = output),
+            updated = max(cases_percap_recent['date']).strftime('%Y-%m-%d'))
+
+    with open(output, 'w') as f:
+        f.write(page)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run the case load ETL and render the dashboard page.')
+    parser.add_argument('--output', default = os.path.join(PUBLISH_DIR, 'case_load_vs_case_delta.html'))
+    parser.add_argument('--log', default = None, help = "append per-stage timing records here as JSON lines ('-' for stderr)")
+    parser.add_argument('--profile', default = None, metavar = 'DIR',
+                        help = 'also cProfile each stage into DIR/<stage>.prof (view with snakeviz)')
+    parser.add_argument('--backend', choices = ['pandas', 'duckdb'], default = None,
+                        help = 'where the snapshot comes from (default $COVID_ETL_BACKEND or pandas), '
+                               'duckdb only reads the trailing days it needs instead of the whole history')
+    args = parser.parse_args()
+
+    # the ETL builds its own pipeline, which picks the backend up from here
+    if args.backend:
+        os.environ['COVID_ETL_BACKEND'] = args.backend
+
+    from covid_etl import instrument
+
+    if args.log or args.profile:
+        instrument.configure(args.log, args.profile)
+
+    start = time.perf_counter()
+    etl = runpy.run_path(os.path.join(PUBLISH_DIR, 'case_load_vs_case_delta_etl.py'), run_name = 'etl')
+    etl_time = time.perf_counter() - start
+
+    # the snapshot stage is already in memory, before the ETL renamed its columns for display
+    cases_percap_recent = etl['pipe'].run('snapshot')
+    with instrument.timed('render', [cases_percap_recent]):
+        render(cases_percap_recent, args.output)
+    print(f'Wrote {args.output} (ETL {etl_time:.1f}s, render {time.perf_counter() - start - etl_time:.1f}s)')
@@ -0,0 +1,85 @@
+# Incremental refresh of the NYT snapshot against a fake server, see covid_etl/nyt.py
+
+import hashlib
+
+import pandas as pd
+
+from covid_etl import nyt
+
+HEADER = b'date,county,state,fips,cases,deaths\n'
+
+
+def day(date):
+    return b''.join(f'{date},County {i},State,{1000 + i},{i * 10},{i}\n'.encode() for i in range(50))
+
+
+class Response:
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def raise_for_status(self):
+        pass
+
+
+class Server:
+    """Serves `content`, honoring Range unless `ignore_range` is set."""
+
+    def __init__(self, content):
+        self.content = content
+        self.ignore_range = False
+
+    def get(self, url, headers = None, timeout = None):
+        headers = headers or {}
+        etag = '"' + hashlib.sha1(self.content).hexdigest() + '"'
+        if headers.get('If-None-Match') == etag:
+            return Response(304, b'', {'ETag': etag})
+        if 'Range' in headers and not self.ignore_range:
+            start = int(headers['Range'][len('bytes='):-1])
+            return Response(206, self.content[start:],
+                            {'ETag': etag, 'Content-Range': f'bytes {start}-{len(self.content) - 1}/{len(self.content)}'})
+        return Response(200, self.content, {'ETag': etag})
+
+
+def test_206_then_200_keeps_the_hash_and_skips_the_full_refresh(tmp_path, monkeypatch):
+    server = Server(HEADER + day('2020-04-01'))
+    snapshot_dir = str(tmp_path)
+    assert nyt.refresh('http://nyt/us-counties.csv', snapshot_dir, server) == 50
+
+    full_refreshes = []
+    full_refresh = nyt._full_refresh
+    monkeypatch.setattr(nyt, '_full_refresh', lambda *args: full_refreshes.append(args) or full_refresh(*args))
+
+    # an ordinary incremental update
+    server.content += day('2020-04-02')
+    assert nyt.refresh('http://nyt/us-counties.csv', snapshot_dir, server) == 50
+    meta = nyt._read_meta(snapshot_dir)
+    assert meta['length'] == len(server.content)
+    version = nyt.snapshot_version(snapshot_dir)
+
+    # the server ignores Range this time: what we hold still checks out, only the new day is parsed
+    server.content += day('2020-04-03')
+    server.ignore_range = True
+    assert nyt.refresh('http://nyt/us-counties.csv', snapshot_dir, server) == 50
+    assert full_refreshes == []
+    assert nyt._read_meta(snapshot_dir)['sha256'] == hashlib.sha256(server.content).hexdigest()
+    assert nyt.snapshot_version(snapshot_dir) != version
+
+    cases = nyt.load_cases(snapshot_dir = snapshot_dir, update = False)
+    assert len(cases) == 150
+    assert list(cases['date'].drop_duplicates()) == list(pd.to_datetime(['2020-04-01', '2020-04-02', '2020-04-03']))
+
+
+def test_200_with_revised_history_does_a_full_refresh(tmp_path):
+    server = Server(HEADER + day('2020-04-01'))
+    snapshot_dir = str(tmp_path)
+    nyt.refresh('http://nyt/us-counties.csv', snapshot_dir, server)
+    server.content += day('2020-04-02')
+    nyt.refresh('http://nyt/us-counties.csv', snapshot_dir, server)
+
+    # the first day revised, and Range ignored: only the whole file can be trusted now
+    server.content = server.content.replace(b'County 0,State,1000,0,0', b'County 0,State,1000,5,0', 1)
+    server.ignore_range = True
+    assert nyt.refresh('http://nyt/us-counties.csv', snapshot_dir, server) == 100